@@ -1,16 +1,45 @@
+import asyncio
+import json
 from datetime import datetime
 from typing import List, Optional
 
-from common.utils import get_redis_connection
-from fastapi import APIRouter, Body
-from models import Action, SessionDep, Stage, StepsInfo, VideoPath
-from pydantic import BaseModel
+from common.cascade import soft_delete_action, soft_delete_videos
+from common.events import action_event, broker, mark_action_event
+from common.idempotency import KeyReused, fingerprint, release, reserve, save
+from common.ingest import StreamingIngest, ingest_action_results, validate_action_data
+from common.job_queue import (DEFAULT_PRIORITY, PRIORITIES, boost, claim_job, defer_jobs, enqueue_jobs,
+                              extend_job, finish_job, queue_status, set_job_priority,
+                              set_tenant_weight)
+from common.metrics import action_times, throughput
+from common.progress import buffer_progress, merge_buffered_progress, take_buffered_progress
+from common.summary import refresh_action_summary
+from common.transcode import settle
+from config import ingest_batch_size, ingest_max_line, scheduler_share_by, sse_keepalive
+from fastapi import APIRouter, Body, Header, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
+from models import Action, Doctors, Patients, SessionDep, VideoPath, engine
+from pydantic import BaseModel, ValidationError
+from redis.exceptions import RedisError
+from sqlalchemy import insert, update
+from sqlmodel import Session
 
 
 class CreateAction(BaseModel):
     patient_id: int
     video_id: int
     parent_id: Optional[int] = None
+    priority: Optional[str] = None
+
+
+class CreateActionItem(BaseModel):
+    video_id: int
+    parent_id: Optional[int] = None
+
+
+class CreateActionsBatch(BaseModel):
+    patient_id: int
+    videos: List[CreateActionItem]
+    priority: Optional[str] = None
 
 
 class StepsInfoData(BaseModel):
@@ -36,6 +65,12 @@ class UpdateActionData(BaseModel):
     steps_info: Optional[List[StepsInfoData]]
 
 
+class StageRecord(BaseModel):
+    stage_n: int
+    start_frame: int
+    end_frame: int
+
+
 class UpdateAction(BaseModel):
     action_id: int
     data: Optional[List[UpdateActionData]]
@@ -52,38 +87,181 @@ class UpdateActionProgress(BaseModel):
     progress: str
 
 
+class UpdateActionPriority(BaseModel):
+    action_id: int
+    priority: str
+
+
+class TenantWeight(BaseModel):
+    tenant: str
+    weight: float
+
+
+class ClaimJob(BaseModel):
+    consumer: str
+
+
+class ExtendJob(BaseModel):
+    action_id: int
+    consumer: str
+
+
 router = APIRouter(tags=["actions"], prefix="/actions")
-redis_conn = get_redis_connection()
+
+
+def _check_priority(priority: str) -> None:
+    if priority not in PRIORITIES:
+        raise HTTPException(
+            status_code=400, detail=f"Unknown priority {priority}, expected one of {', '.join(PRIORITIES)}")
+
+
+def _per_minute(rate: float | None) -> float | None:
+    return round(rate * 60, 2) if rate else None
+
+
+def _job_tenant(session, patient_id: int) -> str:
+    # fair share is split per doctor, or per department when configured
+    doctor = session.query(Doctors).join(Patients, Patients.doctor_id == Doctors.id).filter(
+        Patients.id == patient_id).first()
+    if not doctor:
+        return "default"
+    if scheduler_share_by == "department":
+        return f"department:{doctor.department}"
+    return f"doctor:{doctor.id}"
+
+
+def _find_videos(session, patient_id: int, video_ids) -> dict:
+    videos = session.query(VideoPath).filter(VideoPath.id.in_(video_ids), VideoPath.patient_id == patient_id,
+                                             VideoPath.original_video == True, VideoPath.is_deleted == False).all()
+    return {video.id: video for video in videos}
+
+
+def _create_actions(session, patient_id: int, items, videos: dict) -> list[int]:
+    """Create one waiting action per ``(video_id, parent_id)``.
+
+    The rows are inserted with one multi-row INSERT and primary actions
+    become their own parent in the same transaction, committed once.
+    """
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    action_ids = session.scalars(
+        insert(Action).returning(Action.id, sort_by_parameter_order=True),
+        [{"patient_id": patient_id, "video_id": video_id, "parent_id": parent_id, "status": "waiting",
+          "progress": "waiting for processing", "is_deleted": False, "create_time": now, "update_time": now}
+         for video_id, parent_id in items]
+    ).all()
+    session.execute(update(Action).where(Action.id.in_(action_ids), Action.parent_id == None)
+                    .values(parent_id=Action.id), execution_options={"synchronize_session": False})
+    for (video_id, _), action_id in zip(items, action_ids):
+        videos[video_id].action_id = action_id
+        videos[video_id].update_time = now
+    session.commit()
+    return action_ids
+
+
+def _enqueue_actions(session, patient_id: int, items, action_ids, priority: str, transcoding=()) -> None:
+    """Queue the jobs of new actions; those of videos in ``transcoding`` are
+    held back until the conversion ends."""
+    tenant = _job_tenant(session, patient_id)
+    # re-analyses are usually someone waiting on a corrected result
+    jobs = [(patient_id, action_id, video_id, tenant, boost(priority) if parent_id else priority)
+            for (video_id, parent_id), action_id in zip(items, action_ids)]
+    queued = [job for job in jobs if job[2] not in transcoding]
+    deferred = [job for job in jobs if job[2] in transcoding]
+    try:
+        enqueue_jobs(queued)
+    except RedisError as e:
+        _fail_unqueued(session, queued, e)
+    if not deferred:
+        return
+    try:
+        defer_jobs(deferred)
+    except RedisError as e:
+        _fail_unqueued(session, deferred, e)
+        return
+    # the conversion may have ended while the actions were created
+    for video_id in {job[2] for job in deferred}:
+        try:
+            settle(video_id)
+        except RedisError as e:
+            # the jobs are held back and released when the conversion ends
+            print(f"Failed to settle video {video_id}: {e}")
+
+
+def _fail_unqueued(session, jobs, error) -> None:
+    # The actions are committed but have no job; left waiting they would
+    # never run, and an idempotent retry only replays the response.
+    print(f"Failed to queue actions {', '.join(str(job[1]) for job in jobs)}: {error}")
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    for action in session.query(Action).filter(Action.id.in_([job[1] for job in jobs])).all():
+        action.status = "failed"
+        action.progress = "could not be queued"
+        action.update_time = now
+        mark_action_event(session, action)
+    session.commit()
 
 
 @router.post("/")
 async def create_action(action: CreateAction = Body(...), session: SessionDep = SessionDep):
-    video = session.query(VideoPath).filter(VideoPath.id == action.video_id,
-                                            VideoPath.patient_id == action.patient_id, VideoPath.original_video == True, VideoPath.is_deleted == False).first()
-    if not video:
+    priority = action.priority or DEFAULT_PRIORITY
+    _check_priority(priority)
+    videos = _find_videos(session, action.patient_id, [action.video_id])
+    if not videos:
         return {"message": "Video not found"}
-    new_action = Action(patient_id=action.patient_id,
-                        video_id=action.video_id, status="waiting", progress="waiting for processing", is_deleted=False, create_time=datetime.now().strftime("%Y-%m-%d %H:%M:%S"), update_time=datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                        parent_id=action.parent_id if action.parent_id else None)
-    session.add(new_action)
-    session.commit()
-    action_id = new_action.id
-    action_ = session.query(Action).filter(
-        Action.id == action_id, Action.is_deleted == False).first()
-    if not action_:
-        return {"message": "Action not found"}
-    action_.parent_id = action.parent_id if action.parent_id else action_id
-    session.commit()
-    redis_client = get_redis_connection()
-    redis_client.rpush("waiting_actions",
-                       f"{action.patient_id}-{action_id}-{action.video_id}")
-    video.action_id = action_id
-    video.update_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    session.add(video)
-    session.commit()
+    if videos[action.video_id].status == "failed":
+        return {"message": "Video conversion failed"}
+    transcoding = {video_id for video_id, video in videos.items() if video.status == "transcoding"}
+    items = [(action.video_id, action.parent_id)]
+    action_ids = _create_actions(session, action.patient_id, items, videos)
+    _enqueue_actions(session, action.patient_id, items, action_ids, priority, transcoding)
+    action_id, = action_ids
     return {"message": "Action created successfully", "action_id": action_id}
 
 
+@router.post("/batch")
+async def create_actions(batch: CreateActionsBatch = Body(...), session: SessionDep = SessionDep,
+                         idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key",
+                                                                 description="重复提交时返回首次提交的结果")):
+    priority = batch.priority or DEFAULT_PRIORITY
+    _check_priority(priority)
+    video_ids = [item.video_id for item in batch.videos]
+    if not video_ids:
+        raise HTTPException(status_code=400, detail="No videos given")
+    if len(set(video_ids)) != len(video_ids):
+        raise HTTPException(status_code=400, detail="Duplicate video ids")
+    key = f"{batch.patient_id}:{idempotency_key}" if idempotency_key else None
+    items = [(item.video_id, item.parent_id) for item in batch.videos]
+    payload_hash = fingerprint({"videos": items, "priority": priority})
+    if key:
+        try:
+            owned, response = reserve(key, payload_hash)
+        except KeyReused:
+            raise HTTPException(status_code=422, detail="This idempotency key was used for a different request")
+        if response is not None:
+            return response
+        if not owned:
+            raise HTTPException(status_code=409, detail="A request with this idempotency key is in progress")
+    try:
+        videos = _find_videos(session, batch.patient_id, video_ids)
+        missing = [video_id for video_id in video_ids if video_id not in videos]
+        if missing:
+            raise HTTPException(status_code=404, detail=f"Videos not found: {', '.join(map(str, missing))}")
+        if failed := [video_id for video_id in video_ids if videos[video_id].status == "failed"]:
+            raise HTTPException(status_code=400, detail=f"Video conversion failed: {', '.join(map(str, failed))}")
+        transcoding = {video_id for video_id, video in videos.items() if video.status == "transcoding"}
+        action_ids = _create_actions(session, batch.patient_id, items, videos)
+    except Exception:
+        # nothing was committed, so a retry may run again
+        if key:
+            release(key)
+        raise
+    response = {"message": "Actions created successfully", "action_ids": action_ids}
+    # remembered before scheduling: a retry must never create the actions twice
+    if key:
+        await save(key, payload_hash, response)
+    _enqueue_actions(session, batch.patient_id, items, action_ids, priority, transcoding)
+    return response
+
+
 @router.get("/get_actions/{patient_id}")
 async def get_actions(patient_id: int, session: SessionDep = SessionDep):
     actions = session.query(Action).filter(
@@ -91,7 +269,7 @@ async def get_actions(patient_id: int, session: SessionDep = SessionDep):
     if not actions:
         return {"message": "No actions found"}
     actions = sorted(actions, key=lambda x: x.create_time, reverse=True)
-    return {"actions": [action.to_dict() for action in actions]}
+    return {"actions": merge_buffered_progress([action.to_dict() for action in actions])}
 
 
 @router.get("/get_action_by_id/{action_id}")
@@ -100,7 +278,69 @@ async def get_action_by_id(action_id: int, session: SessionDep = SessionDep):
         Action.id == action_id, Action.is_deleted == False).first()
     if not action:
         return {"message": "Action not found"}
-    return {"action": action.to_dict()}
+    return {"action": merge_buffered_progress([action.to_dict()])[0]}
+
+
+@router.get("/get_actions/{patient_id}/queue_status")
+async def get_patient_queue_status(patient_id: int, session: SessionDep = SessionDep):
+    action_ids = [row.id for row in session.query(Action.id).filter(
+        Action.patient_id == patient_id, Action.is_deleted == False).all()]
+    if not action_ids:
+        return {"message": "No actions found"}
+    return {"queue_status": [{"action_id": action_id, **status}
+                             for action_id, status in queue_status(action_ids).items()],
+            "throughput_per_minute": _per_minute(throughput())}
+
+
+@router.get("/{action_id}/queue_status")
+async def get_action_queue_status(action_id: int):
+    status = queue_status([action_id])[action_id]
+    return {"action_id": action_id, **status, "times": action_times(action_id),
+            "throughput_per_minute": _per_minute(throughput())}
+
+
+def _sse(data: dict) -> str:
+    return f"event: action\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@router.get("/stream")
+async def stream_actions(request: Request,
+                         patient_id: Optional[int] = Query(default=None, description="只推送该患者的任务"),
+                         action_id: Optional[int] = Query(default=None, description="只推送该任务")):
+    # Subscribe, and wait for Redis to confirm it, before the snapshot so
+    # nothing between the two is missed
+    subscription = broker.subscribe(patient_id, action_id)
+    if not await broker.ready():
+        print("Action event subscription not confirmed, streaming without it")
+    snapshot = []
+    if patient_id is not None or action_id is not None:
+        filters = [Action.is_deleted == False]
+        if patient_id is not None:
+            filters.append(Action.patient_id == patient_id)
+        if action_id is not None:
+            filters.append(Action.id == action_id)
+        # A short-lived session: the stream itself may stay open for hours
+        with Session(engine) as session:
+            snapshot = merge_buffered_progress(
+                [action_event(action) for action in session.query(Action).filter(*filters).all()],
+                "action_id")
+
+    async def events():
+        try:
+            for item in snapshot:
+                yield _sse(item)
+            while not await request.is_disconnected():
+                try:
+                    item = await asyncio.wait_for(subscription.queue.get(), timeout=sse_keepalive)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                yield _sse(item)
+        finally:
+            broker.unsubscribe(subscription)
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 
 @router.get("/get_action_by_parent_id/{parent_id}")
@@ -110,7 +350,7 @@ async def get_action_by_parent_id(parent_id: int, session: SessionDep = SessionD
     if not action:
         return {"message": "No actions found"}
     action = sorted(action, key=lambda x: x.create_time, reverse=True)
-    return {"action": [a.to_dict() for a in action]}
+    return {"action": merge_buffered_progress([a.to_dict() for a in action])}
 
 
 @router.delete("/delete_action/{action_id}")
@@ -119,99 +359,146 @@ async def delete_action(action_id: int, session: SessionDep = SessionDep):
         Action.id == action_id, Action.is_deleted == False).first()
     if not action:
         return {"message": "Action not found"}
-    action.is_deleted = True
-    action.update_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    deleted = soft_delete_action(session, action)
     if action.parent_id == action_id:
-        actions = session.query(Action).filter(
-            Action.parent_id == action_id, Action.is_deleted == False).all()
-        for action_ in actions:
-            action_.is_deleted = True
-            action_.update_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            stages = session.query(Stage).filter(
-                Stage.action_id == action_.id, Stage.is_deleted == False).all()
-            for stage in stages:
-                stage.is_deleted = True
-                stage.update_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                steps_info = session.query(StepsInfo).filter(
-                    StepsInfo.stage_id == stage.id, StepsInfo.is_deleted == False).all()
-                for step_info in steps_info:
-                    step_info.is_deleted = True
-                    step_info.update_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        videos = session.query(VideoPath).filter(
-            VideoPath.action_id == action_id, VideoPath.is_deleted == False).all()
-        for video in videos:
-            video.is_deleted = True
-            video.update_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    stages = session.query(Stage).filter(
-        Stage.action_id == action_id, Stage.is_deleted == False).all()
-    for stage in stages:
-        stage.is_deleted = True
-        stage.update_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        steps_info = session.query(StepsInfo).filter(
-            StepsInfo.stage_id == stage.id, StepsInfo.is_deleted == False).all()
-        for step_info in steps_info:
-            step_info.is_deleted = True
-            step_info.update_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        deleted["videos"] += soft_delete_videos(session, VideoPath.action_id == action_id)
     session.commit()
-    redis_conn.lrem("waiting_actions", 0,
-                    f"{action.patient_id}-{action_id}-{action.video_id}")
-    redis_conn.lrem("running_actions", 0,
-                    f"{action.patient_id}-{action_id}-{action.video_id}")
-    return {"message": "Action deleted successfully"}
+    return {"message": "Action deleted successfully", "deleted": deleted}
 
 
 @router.put("/update_action")
 async def update_action(data: UpdateAction = Body(...), session: SessionDep = SessionDep):
+    stages = data.data or []
+    errors = validate_action_data(stages)
+    if errors:
+        raise HTTPException(status_code=400, detail="; ".join(errors))
     action = session.query(Action).filter(
         Action.id == data.action_id, Action.is_deleted == False).first()
     if not action:
         return {"message": "Action not found"}
-    for stage_data in sorted(data.data, key=lambda x: x.stage_n):
-        stage = Stage(action_id=data.action_id, stage_n=stage_data.stage_n,
-                      start_frame=stage_data.start_frame, end_frame=stage_data.end_frame, is_deleted=False, create_time=datetime.now().strftime("%Y-%m-%d %H:%M:%S"), update_time=datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
-        session.add(stage)
-        session.commit()
-        for n, step_info in enumerate(stage_data.steps_info):
-            step_info_db = StepsInfo(stage_id=stage.id, step_id=n + 1,
-                                     start_frame=step_info.start_frame, end_frame=step_info.end_frame,
-                                     step_length=step_info.step_length, step_speed=step_info.step_speed,
-                                     front_leg=step_info.front_leg, hip_min_degree=step_info.hip_min_degree,
-                                     hip_max_degree=step_info.hip_max_degree, first_step=step_info.first_step,
-                                     steps_diff=step_info.steps_diff, stride_length=step_info.stride_length,
-                                     step_width=step_info.step_width,
-                                     support_time=step_info.support_time, liftoff_height=step_info.liftoff_height,
-                                     is_deleted=False, create_time=datetime.now().strftime("%Y-%m-%d %H:%M:%S"), update_time=datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
-            session.add(step_info_db)
+    # One transaction: a failure part way leaves no partial result behind
+    ingest_action_results(session, data.action_id, stages)
+    refresh_action_summary(session, data.action_id)
     session.commit()
     return {"message": "Action updated successfully"}
 
 
+def _ingest_record(ingest: StreamingIngest, line: bytes) -> None:
+    if not line.strip():
+        return
+    record = json.loads(line)
+    if not isinstance(record, dict):
+        raise ValueError("record must be a JSON object")
+    record_type = record.pop("type", None)
+    models_ = {"stage": StageRecord, "step": StepsInfoData}
+    if record_type not in models_:
+        raise ValueError(f"unknown record type: {record_type}")
+    try:
+        item = models_[record_type](**record)
+    except ValidationError as e:
+        fields = ", ".join(f"{'.'.join(map(str, err['loc']))} {err['msg'].lower()}" for err in e.errors())
+        raise ValueError(f"invalid {record_type} record: {fields}")
+    if record_type == "stage":
+        ingest.add_stage(item)
+    else:
+        ingest.add_step(item)
+
+
+@router.post("/ingest_stream/{action_id}")
+async def ingest_action_stream(action_id: int, request: Request, session: SessionDep = SessionDep):
+    """Newline-delimited results: ``{"type": "stage", ...}`` followed by the
+    ``{"type": "step", ...}`` records of that stage. Committed in batches."""
+    action = session.query(Action).filter(
+        Action.id == action_id, Action.is_deleted == False).first()
+    if not action:
+        return {"message": "Action not found"}
+    ingest = StreamingIngest(session, action_id, ingest_batch_size)
+    buffer = b""
+    line_no = 0
+    try:
+        async for chunk in request.stream():
+            buffer += chunk
+            *lines, buffer = buffer.split(b"\n")
+            for line in lines:
+                line_no += 1
+                _ingest_record(ingest, line)
+            if len(buffer) > ingest_max_line:
+                raise ValueError("record too long")
+        if buffer.strip():
+            line_no += 1
+            _ingest_record(ingest, buffer)
+        ingest.flush()
+    except ValueError as e:
+        session.rollback()
+        raise HTTPException(
+            status_code=400, detail=f"line {line_no}: {e} ({ingest.batches} batches already committed)")
+    return {"message": "Action updated successfully", "stages": ingest.stages,
+            "steps": ingest.steps, "batches": ingest.batches}
+
+
 @router.post("/update_action_status")
 async def update_action_status(action_status: UpdateActionStatus, session: SessionDep = SessionDep):
     action_id = action_status.action_id
     status = action_status.status
-    action_name = action_status.action
     if status != "running":
-        redis_conn.lrem("running_actions", 0, action_name)
+        finish_job(action_id)
     action = session.query(Action).filter(
         Action.id == action_id, Action.is_deleted == False).first()
     if not action:
         return {"message": "Action not found"}
     action.status = status
+    # status changes are written through, with any progress still buffered
+    if pending := take_buffered_progress(action_id):
+        action.progress = pending["progress"]
     action.update_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    mark_action_event(session, action)
     session.commit()
     return {"message": "Action status updated successfully"}
 
 
 @router.post("/update_action_progress")
 async def update_action_progress(action_progress: UpdateActionProgress, session: SessionDep = SessionDep):
-    action_id = action_progress.action_id
-    progress = action_progress.progress
-    action = session.query(Action).filter(
-        Action.id == action_id, Action.is_deleted == False).first()
-    if not action:
+    # Buffered and flushed in batches; see common.progress
+    if not buffer_progress(session, action_progress.action_id, action_progress.progress):
         return {"message": "Action not found"}
-    action.progress = progress
-    action.update_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    session.commit()
     return {"message": "Action progress updated successfully"}
+
+
+@router.post("/update_action_priority")
+async def update_action_priority(data: UpdateActionPriority = Body(...)):
+    _check_priority(data.priority)
+    if not set_job_priority(data.action_id, data.priority):
+        return {"message": "Action is not waiting in the queue"}
+    return {"message": "Action priority updated successfully"}
+
+
+@router.post("/jobs/weights")
+async def update_tenant_weight(data: TenantWeight = Body(...)):
+    if data.weight <= 0:
+        raise HTTPException(status_code=400, detail="Weight must be positive")
+    set_tenant_weight(data.tenant, data.weight)
+    return {"message": "Weight updated successfully"}
+
+
+@router.post("/jobs/claim")
+async def claim_action_job(data: ClaimJob = Body(...), session: SessionDep = SessionDep):
+    job, dead = claim_job(data.consumer)
+    if dead:
+        actions = session.query(Action).filter(
+            Action.id.in_([j["action_id"] for j in dead]), Action.is_deleted == False).all()
+        for action in actions:
+            action.status = "failed"
+            action.progress = "gave up after repeated worker failures"
+            action.update_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            mark_action_event(session, action)
+        session.commit()
+    if not job:
+        return {"message": "No job available"}
+    return {"job": job}
+
+
+@router.post("/jobs/extend")
+async def extend_action_job(data: ExtendJob = Body(...)):
+    if not extend_job(data.action_id, data.consumer):
+        return {"message": "Job not found"}
+    return {"message": "Job extended successfully"}
@@ -1,33 +1,56 @@
 import math
+from typing import List, Optional
+
+import numpy as np
+from common.cache import cached_chart
+from common.downsample import downsample_steps
+from common.etag import action_etag
+from common.steps import load_action_steps, load_actions_steps
 from common.utils import get_length_to_show
-from fastapi import APIRouter
-from models import SessionDep, Stage, StepsInfo
+from fastapi import APIRouter, Depends, HTTPException, Query
+from models import Action, SessionDep
 from pyecharts import options as opts
 from pyecharts.charts import Line
 from pyecharts.globals import ThemeType
 
-router = APIRouter(tags=["dashboard"], prefix="/dashboard")
+router = APIRouter(tags=["dashboard"], prefix="/dashboard",
+                   dependencies=[Depends(action_etag)])
 
 toolbox_opts = opts.global_options.ToolBoxFeatureOpts(
     save_as_image={"show": True, "title": "save as image", "type": "png"})
 
+HIP_COLUMNS = ("hip_min_degree", "hip_max_degree")
+
+MaxPointsQuery = Query(
+    default=None, ge=0, description="LTTB 降采样后的最大点数, 0 表示不降采样, 默认取 LENGTH_TO_SHOW")
+RawMaxPointsQuery = Query(
+    default=None, ge=0, description="LTTB 降采样后的最大点数; 不传时 /raw/ 接口也只返回约 LENGTH_TO_SHOW (默认 20) 个点, "
+                                    "需要每一步的完整数据请传 max_points=0")
+
+
+def _step_labels(steps):
+    return [f"第{n}步" for n in steps["step_no"].tolist()]
+
+
+def _step_pair_labels(steps):
+    return [f"第{n} - {n + 1}步" for n in steps["step_no"].tolist()]
 
-@router.get("/step_hip_degree/{action_id}")
-def get_step_hip_degree_overlap(action_id: int, session: SessionDep = SessionDep):
-    x_data = []
-    y_low_data = []
-    y_high_data = []
-    step = 1
-    stages = session.query(Stage).filter(
-        Stage.action_id == action_id, Stage.is_deleted == False).all()
-    for stage in stages:
-        steps_info = session.query(StepsInfo).filter(
-            StepsInfo.stage_id == stage.id, StepsInfo.is_deleted == False).all()
-        for step_info in steps_info:
-            x_data.append(f"第{step}步")
-            y_low_data.append(round(step_info.hip_min_degree, 2))
-            y_high_data.append(round(step_info.hip_max_degree, 2))
-            step += 1
+
+def _series(values, scale=1):
+    return np.round(values * scale, 2).tolist()
+
+
+def _series_by_leg(steps, column, scale=1):
+    # Left and right steps share one x axis; the other leg's slot stays None
+    values = np.round(steps[column] * scale, 2).astype(object)
+    is_left = steps["front_leg"] == "left"
+    return np.where(is_left, values, None).tolist(), np.where(is_left, None, values).tolist()
+
+
+def _step_hip_degree_chart(steps):
+    x_data = _step_labels(steps)
+    y_low_data = _series(steps["hip_min_degree"])
+    y_high_data = _series(steps["hip_max_degree"])
 
     line = Line({"theme": "light"})
     line.add_xaxis(xaxis_data=x_data)
@@ -86,39 +109,17 @@ def get_step_hip_degree_overlap(action_id: int, session: SessionDep = SessionDep
     return line.dump_options_with_quotes()
 
 
-@router.get("/step_hip_degree/raw/{action_id}")
-def get_step_hip_degree_raw(action_id: int, session: SessionDep = SessionDep):
-    x_data = []
-    y_low_data = []
-    y_high_data = []
-    step = 1
-    stages = session.query(Stage).filter(
-        Stage.action_id == action_id, Stage.is_deleted == False).all()
-    for stage in stages:
-        steps_info = session.query(StepsInfo).filter(
-            StepsInfo.stage_id == stage.id, StepsInfo.is_deleted == False).all()
-        for step_info in steps_info:
-            x_data.append(f"第{step}步")
-            y_low_data.append(round(step_info.hip_min_degree, 2))
-            y_high_data.append(round(step_info.hip_max_degree, 2))
-            step += 1
+def _step_hip_degree_raw(steps):
+    x_data = _step_labels(steps)
+    y_low_data = _series(steps["hip_min_degree"])
+    y_high_data = _series(steps["hip_max_degree"])
     return {"x_data": x_data, "y_low_data": y_low_data, "y_high_data": y_high_data}
 
 
-@router.get("/step_width/{action_id}")
-def get_step_width(action_id: int, session: SessionDep = SessionDep):
-    x_data = []
-    y_data = []
-    step = 1
-    stages = session.query(Stage).filter(
-        Stage.action_id == action_id, Stage.is_deleted == False).all()
-    for stage in stages:
-        steps_info = session.query(StepsInfo).filter(
-            StepsInfo.stage_id == stage.id, StepsInfo.is_deleted == False).all()
-        for step_info in steps_info:
-            x_data.append(f"第{step}步")
-            y_data.append(round(step_info.step_width * 100, 2))
-            step += 1
+def _step_width_chart(steps):
+    x_data = _step_labels(steps)
+    y_data = _series(steps["step_width"], 100)
+
     line = Line()
     line.add_xaxis(xaxis_data=x_data)
     line.add_yaxis(series_name="步宽", y_axis=y_data, is_smooth=True)
@@ -153,43 +154,16 @@ def get_step_width(action_id: int, session: SessionDep = SessionDep):
     return line.dump_options_with_quotes()
 
 
-@router.get("/step_width/raw/{action_id}")
-def get_step_width_raw(action_id: int, session: SessionDep = SessionDep):
-    x_data = []
-    y_data = []
-    step = 1
-    stages = session.query(Stage).filter(
-        Stage.action_id == action_id, Stage.is_deleted == False).all()
-    for stage in stages:
-        steps_info = session.query(StepsInfo).filter(
-            StepsInfo.stage_id == stage.id, StepsInfo.is_deleted == False).all()
-        for step_info in steps_info:
-            x_data.append(f"第{step}步")
-            y_data.append(round(step_info.step_width, 2))
-            step += 1
+def _step_width_raw(steps):
+    x_data = _step_labels(steps)
+    y_data = _series(steps["step_width"])
     return {"x_data": x_data, "y_data": y_data}
 
 
-@router.get("/step_length/{action_id}")
-def get_step_length(action_id: int, session: SessionDep = SessionDep):
-    x_data = []
-    y_left = []
-    y_right = []
-    step = 1
-    stages = session.query(Stage).filter(
-        Stage.action_id == action_id, Stage.is_deleted == False).all()
-    for stage in stages:
-        steps_info = session.query(StepsInfo).filter(
-            StepsInfo.stage_id == stage.id, StepsInfo.is_deleted == False).all()
-        for step_info in steps_info:
-            x_data.append(f"第{step}步")
-            if step_info.front_leg == "left":
-                y_left.append(round(step_info.step_length * 100, 2))
-                y_right.append(None)
-            else:
-                y_left.append(None)
-                y_right.append(round(step_info.step_length * 100, 2))
-            step += 1
+def _step_length_chart(steps):
+    x_data = _step_labels(steps)
+    y_left, y_right = _series_by_leg(steps, "step_length", 100)
+
     line = Line(init_opts=opts.InitOpts(theme=ThemeType.DARK))
     line.add_xaxis(xaxis_data=x_data)
     line.add_yaxis(series_name="左脚", y_axis=y_left,
@@ -231,49 +205,16 @@ def get_step_length(action_id: int, session: SessionDep = SessionDep):
     return line.dump_options_with_quotes()
 
 
-@router.get("/step_length/raw/{action_id}")
-def get_step_length_raw(action_id: int, session: SessionDep = SessionDep):
-    x_data = []
-    y_left = []
-    y_right = []
-    step = 1
-    stages = session.query(Stage).filter(
-        Stage.action_id == action_id, Stage.is_deleted == False).all()
-    for stage in stages:
-        steps_info = session.query(StepsInfo).filter(
-            StepsInfo.stage_id == stage.id, StepsInfo.is_deleted == False).all()
-        for step_info in steps_info:
-            x_data.append(f"第{step}步")
-            if step_info.front_leg == "left":
-                y_left.append(round(step_info.step_length, 2))
-                y_right.append(None)
-            else:
-                y_left.append(None)
-                y_right.append(round(step_info.step_length, 2))
-            step += 1
+def _step_length_raw(steps):
+    x_data = _step_labels(steps)
+    y_left, y_right = _series_by_leg(steps, "step_length")
     return {"x_data": x_data, "y_left": y_left, "y_right": y_right}
 
 
-@router.get("/step_speed/{action_id}")
-def get_speed(action_id: int, session: SessionDep = SessionDep):
-    x_data = []
-    y_left_data = []
-    y_right_data = []
-    step = 1
-    stages = session.query(Stage).filter(
-        Stage.action_id == action_id, Stage.is_deleted == False).all()
-    for stage in stages:
-        steps_info = session.query(StepsInfo).filter(
-            StepsInfo.stage_id == stage.id, StepsInfo.is_deleted == False).all()
-        for step_info in steps_info:
-            x_data.append(f"第{step}步")
-            if step_info.front_leg == "left":
-                y_left_data.append(round(step_info.step_speed * 100, 2))
-                y_right_data.append(None)
-            else:
-                y_left_data.append(None)
-                y_right_data.append(round(step_info.step_speed * 100, 2))
-            step += 1
+def _step_speed_chart(steps):
+    x_data = _step_labels(steps)
+    y_left_data, y_right_data = _series_by_leg(steps, "step_speed", 100)
+
     line = Line(init_opts=opts.InitOpts(theme=ThemeType.DARK))
     line.add_xaxis(xaxis_data=x_data)
     line.add_yaxis(series_name="=左脚", y_axis=y_left_data, color="blue",
@@ -316,46 +257,16 @@ def get_speed(action_id: int, session: SessionDep = SessionDep):
     return line.dump_options_with_quotes()
 
 
-@router.get("/step_speed/raw/{action_id}")
-def get_speed_raw(action_id: int, session: SessionDep = SessionDep):
-    x_data = []
-    y_left_data = []
-    y_right_data = []
-    step = 1
-    stages = session.query(Stage).filter(
-        Stage.action_id == action_id, Stage.is_deleted == False).all()
-    for stage in stages:
-        steps_info = session.query(StepsInfo).filter(
-            StepsInfo.stage_id == stage.id, StepsInfo.is_deleted == False).all()
-        for step_info in steps_info:
-            x_data.append(f"第{step}步")
-            if step_info.front_leg == "left":
-                y_left_data.append(round(step_info.step_speed, 2))
-                y_right_data.append(None)
-            else:
-                y_left_data.append(None)
-                y_right_data.append(round(step_info.step_speed, 2))
-            step += 1
+def _step_speed_raw(steps):
+    x_data = _step_labels(steps)
+    y_left_data, y_right_data = _series_by_leg(steps, "step_speed")
     return {"x_data": x_data, "y_left_data": y_left_data, "y_right_data": y_right_data}
 
 
-@router.get("/step_stride/{action_id}")
-def get_step_stride(action_id: int, session: SessionDep = SessionDep):
-    x_data = []
-    y_data = []
-    step = 1
-    stages = session.query(Stage).filter(
-        Stage.action_id == action_id, Stage.is_deleted == False).all()
-    for stage in stages:
-        steps_info = session.query(StepsInfo).filter(
-            StepsInfo.stage_id == stage.id, StepsInfo.is_deleted == False).all()
-        for step_info in steps_info:
-            # if step_info.first_step:
-            #     step += 1
-            #     continue
-            x_data.append(f"第{step}步")
-            y_data.append(round(step_info.stride_length * 100, 2))
-            step += 1
+def _step_stride_chart(steps):
+    x_data = _step_labels(steps)
+    y_data = _series(steps["stride_length"], 100)
+
     line = Line()
     line.add_xaxis(xaxis_data=x_data)
     line.add_yaxis(series_name="步幅", y_axis=y_data, is_smooth=True)
@@ -395,43 +306,16 @@ def get_step_stride(action_id: int, session: SessionDep = SessionDep):
     return line.dump_options_with_quotes()
 
 
-@router.get("/step_stride/raw/{action_id}")
-def get_step_stride_raw(action_id: int, session: SessionDep = SessionDep):
-    x_data = []
-    y_data = []
-    step = 1
-    stages = session.query(Stage).filter(
-        Stage.action_id == action_id, Stage.is_deleted == False).all()
-    for stage in stages:
-        steps_info = session.query(StepsInfo).filter(
-            StepsInfo.stage_id == stage.id, StepsInfo.is_deleted == False).all()
-        for step_info in steps_info:
-            # if step_info.first_step:
-            #     step += 1
-            #     continue
-            x_data.append(f"第{step}步")
-            y_data.append(round(step_info.stride_length, 2))
-            step += 1
+def _step_stride_raw(steps):
+    x_data = _step_labels(steps)
+    y_data = _series(steps["stride_length"])
     return {"x_data": x_data, "y_data": y_data}
 
 
-@router.get("/step_difference/{action_id}")
-def get_step_difference(action_id: int, session: SessionDep = SessionDep):
-    x_data = []
-    y_data = []
-    step = 1
-    stages = session.query(Stage).filter(
-        Stage.action_id == action_id, Stage.is_deleted == False).all()
-    for stage in stages:
-        steps_info = session.query(StepsInfo).filter(
-            StepsInfo.stage_id == stage.id, StepsInfo.is_deleted == False).all()
-        for step_info in steps_info:
-            # if step_info.first_step:
-            #     step += 1
-            #     continue
-            x_data.append(f"第{step} - {step + 1}步")
-            y_data.append(round(step_info.steps_diff * 100, 2))
-            step += 1
+def _step_difference_chart(steps):
+    x_data = _step_pair_labels(steps)
+    y_data = _series(steps["steps_diff"], 100)
+
     line = Line()
     line.add_xaxis(xaxis_data=x_data)
     line.add_yaxis(series_name="步长差", y_axis=y_data, is_smooth=True)
@@ -471,40 +355,16 @@ def get_step_difference(action_id: int, session: SessionDep = SessionDep):
     return line.dump_options_with_quotes()
 
 
-@router.get("/step_difference/raw/{action_id}")
-def get_step_difference_raw(action_id: int, session: SessionDep = SessionDep):
-    x_data = []
-    y_data = []
-    step = 1
-    stages = session.query(Stage).filter(
-        Stage.action_id == action_id, Stage.is_deleted == False).all()
-    for stage in stages:
-        steps_info = session.query(StepsInfo).filter(
-            StepsInfo.stage_id == stage.id, StepsInfo.is_deleted == False).all()
-        for step_info in steps_info:
-            # if step_info.first_step:
-            #     step += 1
-            #     continue
-            x_data.append(f"第{step} - {step + 1}步")
-            y_data.append(round(step_info.steps_diff, 2))
-            step += 1
+def _step_difference_raw(steps):
+    x_data = _step_pair_labels(steps)
+    y_data = _series(steps["steps_diff"])
     return {"x_data": x_data, "y_data": y_data}
 
 
-@router.get("/support_time/{action_id}")
-def get_support_time(action_id: int, session: SessionDep = SessionDep):
-    x_data = []
-    y_data = []
-    step = 1
-    stages = session.query(Stage).filter(
-        Stage.action_id == action_id, Stage.is_deleted == False).all()
-    for stage in stages:
-        steps_info = session.query(StepsInfo).filter(
-            StepsInfo.stage_id == stage.id, StepsInfo.is_deleted == False).all()
-        for step_info in steps_info:
-            x_data.append(f"第{step}步")
-            y_data.append(round(step_info.support_time, 2))
-            step += 1
+def _support_time_chart(steps):
+    x_data = _step_labels(steps)
+    y_data = _series(steps["support_time"])
+
     line = Line()
     line.add_xaxis(xaxis_data=x_data)
     line.add_yaxis(series_name="支撑时间", y_axis=y_data, is_smooth=True)
@@ -544,37 +404,16 @@ def get_support_time(action_id: int, session: SessionDep = SessionDep):
     return line.dump_options_with_quotes()
 
 
-@router.get("/support_time/raw/{action_id}")
-def get_support_time_raw(action_id: int, session: SessionDep = SessionDep):
-    x_data = []
-    y_data = []
-    step = 1
-    stages = session.query(Stage).filter(
-        Stage.action_id == action_id, Stage.is_deleted == False).all()
-    for stage in stages:
-        steps_info = session.query(StepsInfo).filter(
-            StepsInfo.stage_id == stage.id, StepsInfo.is_deleted == False).all()
-        for step_info in steps_info:
-            x_data.append(f"第{step}步")
-            y_data.append(round(step_info.support_time, 2))
-            step += 1
+def _support_time_raw(steps):
+    x_data = _step_labels(steps)
+    y_data = _series(steps["support_time"])
     return {"x_data": x_data, "y_data": y_data}
 
 
-@router.get("/liftoff_height/{action_id}")
-def get_liftoff_height(action_id: int, session: SessionDep = SessionDep):
-    x_data = []
-    y_data = []
-    step = 1
-    stages = session.query(Stage).filter(
-        Stage.action_id == action_id, Stage.is_deleted == False).all()
-    for stage in stages:
-        steps_info = session.query(StepsInfo).filter(
-            StepsInfo.stage_id == stage.id, StepsInfo.is_deleted == False).all()
-        for step_info in steps_info:
-            x_data.append(f"第{step}步")
-            y_data.append(round(step_info.liftoff_height * 100, 2))
-            step += 1
+def _liftoff_height_chart(steps):
+    x_data = _step_labels(steps)
+    y_data = _series(steps["liftoff_height"], 100)
+
     line = Line()
     line.add_xaxis(xaxis_data=x_data)
     line.add_yaxis(series_name="离地距离", y_axis=y_data, is_smooth=True)
@@ -614,23 +453,230 @@ def get_liftoff_height(action_id: int, session: SessionDep = SessionDep):
     return line.dump_options_with_quotes()
 
 
-@router.get("/liftoff_height/raw/{action_id}")
-def get_liftoff_height_raw(action_id: int, session: SessionDep = SessionDep):
-    x_data = []
-    y_data = []
-    step = 1
-    stages = session.query(Stage).filter(
-        Stage.action_id == action_id, Stage.is_deleted == False).all()
-    for stage in stages:
-        steps_info = session.query(StepsInfo).filter(
-            StepsInfo.stage_id == stage.id, StepsInfo.is_deleted == False).all()
-        for step_info in steps_info:
-            x_data.append(f"第{step}步")
-            y_data.append(round(step_info.liftoff_height, 2))
-            step += 1
+def _liftoff_height_raw(steps):
+    x_data = _step_labels(steps)
+    y_data = _series(steps["liftoff_height"])
     return {"x_data": x_data, "y_data": y_data}
 
 
+# chart name -> (step columns, chart builder, raw series builder)
+CHARTS = {
+    "step_hip_degree": (HIP_COLUMNS, _step_hip_degree_chart, _step_hip_degree_raw),
+    "step_width": (("step_width",), _step_width_chart, _step_width_raw),
+    "step_length": (("step_length", "front_leg"), _step_length_chart, _step_length_raw),
+    "step_speed": (("step_speed", "front_leg"), _step_speed_chart, _step_speed_raw),
+    "step_stride": (("stride_length",), _step_stride_chart, _step_stride_raw),
+    "step_difference": (("steps_diff",), _step_difference_chart, _step_difference_raw),
+    "support_time": (("support_time",), _support_time_chart, _support_time_raw),
+    "liftoff_height": (("liftoff_height",), _liftoff_height_chart, _liftoff_height_raw),
+}
+
+
+def _max_points(max_points: Optional[int]) -> int:
+    # 0 disables downsampling; unset falls back to the configured length
+    return get_length_to_show() if max_points is None else max_points
+
+
+def _load_steps(session, action_id: int, columns, max_points: int):
+    return downsample_steps(load_action_steps(session, action_id, columns), max_points)
+
+
+def _render_chart(session, action_id: int, name: str, max_points: int):
+    columns, build_chart, _ = CHARTS[name]
+    return cached_chart(f"{name}:{max_points}", action_id,
+                        lambda: build_chart(_load_steps(session, action_id, columns, max_points)))
+
+
+def _raw_series(session, action_id: int, name: str, max_points: int):
+    columns, _, build_raw = CHARTS[name]
+    return build_raw(_load_steps(session, action_id, columns, max_points))
+
+
+def _parse_chart_names(charts: Optional[List[str]]) -> list[str]:
+    if not charts:
+        return list(CHARTS)
+    names = [name.strip() for value in charts for name in value.split(",") if name.strip()]
+    unknown = [name for name in names if name not in CHARTS]
+    if unknown:
+        raise HTTPException(
+            status_code=400, detail=f"Unknown charts: {', '.join(unknown)}")
+    return list(dict.fromkeys(names))
+
+
+@router.get("/bundle/{action_id}")
+def get_dashboard_bundle(action_id: int,
+                         charts: Optional[List[str]] = Query(
+                             default=None, description="图表名, 逗号分隔或重复传参, 默认全部"),
+                         max_points: Optional[int] = MaxPointsQuery,
+                         session: SessionDep = SessionDep):
+    names = _parse_chart_names(charts)
+    max_points = _max_points(max_points)
+    columns = dict.fromkeys(column for name in names for column in CHARTS[name][0])
+    steps = load_action_steps(session, action_id, columns)
+    # Each chart is downsampled on its own columns, as its standalone route does
+    chart_steps = {name: downsample_steps({column: steps[column] for column in CHARTS[name][0] + ("step_no",)},
+                                          max_points) for name in names}
+    return {
+        "charts": {name: cached_chart(f"{name}:{max_points}", action_id,
+                                      lambda name=name: CHARTS[name][1](chart_steps[name]))
+                   for name in names},
+        "raw": {name: CHARTS[name][2](chart_steps[name]) for name in names},
+    }
+
+
+@router.get("/step_hip_degree/{action_id}")
+def get_step_hip_degree_overlap(action_id: int, max_points: Optional[int] = MaxPointsQuery, session: SessionDep = SessionDep):
+    return _render_chart(session, action_id, "step_hip_degree", _max_points(max_points))
+
+
+@router.get("/step_hip_degree/raw/{action_id}")
+def get_step_hip_degree_raw(action_id: int, max_points: Optional[int] = RawMaxPointsQuery, session: SessionDep = SessionDep):
+    return _raw_series(session, action_id, "step_hip_degree", _max_points(max_points))
+
+
+@router.get("/step_width/{action_id}")
+def get_step_width(action_id: int, max_points: Optional[int] = MaxPointsQuery, session: SessionDep = SessionDep):
+    return _render_chart(session, action_id, "step_width", _max_points(max_points))
+
+
+@router.get("/step_width/raw/{action_id}")
+def get_step_width_raw(action_id: int, max_points: Optional[int] = RawMaxPointsQuery, session: SessionDep = SessionDep):
+    return _raw_series(session, action_id, "step_width", _max_points(max_points))
+
+
+@router.get("/step_length/{action_id}")
+def get_step_length(action_id: int, max_points: Optional[int] = MaxPointsQuery, session: SessionDep = SessionDep):
+    return _render_chart(session, action_id, "step_length", _max_points(max_points))
+
+
+@router.get("/step_length/raw/{action_id}")
+def get_step_length_raw(action_id: int, max_points: Optional[int] = RawMaxPointsQuery, session: SessionDep = SessionDep):
+    return _raw_series(session, action_id, "step_length", _max_points(max_points))
+
+
+@router.get("/step_speed/{action_id}")
+def get_speed(action_id: int, max_points: Optional[int] = MaxPointsQuery, session: SessionDep = SessionDep):
+    return _render_chart(session, action_id, "step_speed", _max_points(max_points))
+
+
+@router.get("/step_speed/raw/{action_id}")
+def get_speed_raw(action_id: int, max_points: Optional[int] = RawMaxPointsQuery, session: SessionDep = SessionDep):
+    return _raw_series(session, action_id, "step_speed", _max_points(max_points))
+
+
+@router.get("/step_stride/{action_id}")
+def get_step_stride(action_id: int, max_points: Optional[int] = MaxPointsQuery, session: SessionDep = SessionDep):
+    return _render_chart(session, action_id, "step_stride", _max_points(max_points))
+
+
+@router.get("/step_stride/raw/{action_id}")
+def get_step_stride_raw(action_id: int, max_points: Optional[int] = RawMaxPointsQuery, session: SessionDep = SessionDep):
+    return _raw_series(session, action_id, "step_stride", _max_points(max_points))
+
+
+@router.get("/step_difference/{action_id}")
+def get_step_difference(action_id: int, max_points: Optional[int] = MaxPointsQuery, session: SessionDep = SessionDep):
+    return _render_chart(session, action_id, "step_difference", _max_points(max_points))
+
+
+@router.get("/step_difference/raw/{action_id}")
+def get_step_difference_raw(action_id: int, max_points: Optional[int] = RawMaxPointsQuery, session: SessionDep = SessionDep):
+    return _raw_series(session, action_id, "step_difference", _max_points(max_points))
+
+
+@router.get("/support_time/{action_id}")
+def get_support_time(action_id: int, max_points: Optional[int] = MaxPointsQuery, session: SessionDep = SessionDep):
+    return _render_chart(session, action_id, "support_time", _max_points(max_points))
+
+
+@router.get("/support_time/raw/{action_id}")
+def get_support_time_raw(action_id: int, max_points: Optional[int] = RawMaxPointsQuery, session: SessionDep = SessionDep):
+    return _raw_series(session, action_id, "support_time", _max_points(max_points))
+
+
+@router.get("/liftoff_height/{action_id}")
+def get_liftoff_height(action_id: int, max_points: Optional[int] = MaxPointsQuery, session: SessionDep = SessionDep):
+    return _render_chart(session, action_id, "liftoff_height", _max_points(max_points))
+
+
+@router.get("/liftoff_height/raw/{action_id}")
+def get_liftoff_height_raw(action_id: int, max_points: Optional[int] = RawMaxPointsQuery, session: SessionDep = SessionDep):
+    return _raw_series(session, action_id, "liftoff_height", _max_points(max_points))
+
+
+# step column -> (title, unit, scale) for the multi-session comparison
+COMPARE_METRICS = {
+    "step_length": ("步长", "厘米", 100),
+    "step_width": ("步宽", "厘米", 100),
+    "step_speed": ("步速", "厘米/秒", 100),
+    "stride_length": ("步幅", "厘米", 100),
+    "steps_diff": ("步长差", "厘米", 100),
+    "support_time": ("支撑时间", "秒", 1),
+    "liftoff_height": ("离地距离", "厘米", 100),
+    "hip_min_degree": ("髋关节最小角度", "度", 1),
+    "hip_max_degree": ("髋关节最大角度", "度", 1),
+}
+
+
+def _compare_series(session, metric: str, parent_id: Optional[int], action_ids: Optional[List[int]], scale=1):
+    if metric not in COMPARE_METRICS:
+        raise HTTPException(status_code=400, detail=f"Unknown metric: {metric}")
+    if parent_id is None and not action_ids:
+        raise HTTPException(
+            status_code=400, detail="Either parent_id or action_ids is required")
+    query = session.query(Action.id, Action.create_time).filter(Action.is_deleted == False)
+    if parent_id is not None:
+        query = query.filter(Action.parent_id == parent_id)
+    if action_ids:
+        query = query.filter(Action.id.in_(action_ids))
+    actions = query.order_by(Action.create_time, Action.id).all()
+
+    steps_by_action = load_actions_steps(session, [action.id for action in actions], (metric,))
+    length = max((len(steps["step_no"]) for steps in steps_by_action.values()), default=0)
+    series = []
+    for action in actions:
+        values = _series(steps_by_action[action.id][metric], scale)
+        # Sessions are aligned by step index; shorter ones are padded
+        series.append({"action_id": action.id, "name": f"#{action.id} {action.create_time}",
+                       "data": values + [None] * (length - len(values))})
+    return [f"第{n}步" for n in range(1, length + 1)], series
+
+
+@router.get("/compare/{metric}")
+def get_compare_chart(metric: str,
+                      parent_id: Optional[int] = Query(default=None),
+                      action_ids: Optional[List[int]] = Query(default=None),
+                      session: SessionDep = SessionDep):
+    title, unit, scale = COMPARE_METRICS.get(metric, (None, None, 1))
+    x_data, series = _compare_series(session, metric, parent_id, action_ids, scale)
+    line = Line()
+    line.add_xaxis(xaxis_data=x_data)
+    for item in series:
+        line.add_yaxis(series_name=item["name"], y_axis=item["data"], is_smooth=True)
+    line.set_global_opts(
+        title_opts=opts.TitleOpts(title=f"{title}对比"),
+        tooltip_opts=opts.TooltipOpts(trigger="axis"),
+        legend_opts=opts.LegendOpts(type_="scroll", pos_top="5%"),
+        xaxis_opts=opts.AxisOpts(axislabel_opts=opts.LabelOpts(rotate=90)),
+        toolbox_opts=opts.ToolboxOpts(feature=toolbox_opts),
+        yaxis_opts=opts.AxisOpts(
+            name=unit,
+            name_location="end",
+            name_gap=15
+        )
+    )
+    return line.dump_options_with_quotes()
+
+
+@router.get("/compare/raw/{metric}")
+def get_compare_raw(metric: str,
+                    parent_id: Optional[int] = Query(default=None),
+                    action_ids: Optional[List[int]] = Query(default=None),
+                    session: SessionDep = SessionDep):
+    x_data, series = _compare_series(session, metric, parent_id, action_ids)
+    return {"x_data": x_data, "series": series}
+
+
 # @router.get("/table/step_hip_degree/{action_id}")
 # def get_average_step_hip_degree(action_id: int, session: SessionDep = SessionDep):
 #     step_hip_degree_low = []
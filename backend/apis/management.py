@@ -4,6 +4,8 @@ import os
 from datetime import datetime
 from typing import Optional, List
 
+from common.cascade import forget_deleted_actions, soft_delete_action, soft_delete_patient, soft_delete_video
+from common.summary import clear_action_summaries
 from common.utils import check_password, hash_password
 from fastapi import APIRouter, Body, HTTPException, Query
 from models import (Action, Doctors, Patients, SessionDep, Stage, StepsInfo,
@@ -431,29 +433,15 @@ def delete_patient(patient_delete_data: DeletePatient, session: SessionDep = Ses
     if not patient_db:
         raise HTTPException(status_code=404, detail="Patient not found")
 
+    deleted = None
     if not patient_delete_data.force:
-        patient_db.is_deleted = True
-        patient_db.update_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
-        videos = session.query(VideoPath).filter(
-            VideoPath.patient_id == patient_delete_data.patient_id, VideoPath.is_deleted == False).all()
-        for video in videos:
-            video.is_deleted = True
-            video.update_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        actions = session.query(Action).filter(
-            Action.patient_id == patient_delete_data.patient_id, Action.is_deleted == False).all()
-        for action in actions:
-            action.is_deleted = True
-            action.update_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            stages = session.query(Stage).filter(
-                Stage.action_id == action.id, Stage.is_deleted == False).all()
-            for stage in stages:
-                stage.is_deleted = True
-                stage.update_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        deleted = soft_delete_patient(session, patient_db.id)
 
     else: # Hard delete
         actions_to_delete = session.query(Action).filter(
             Action.patient_id == patient_db.id).all()
+        clear_action_summaries(session, [action.id for action in actions_to_delete])
+        forget_deleted_actions(session, [action.id for action in actions_to_delete])
         for action in actions_to_delete:
             stages_to_delete = session.query(Stage).filter(
                 Stage.action_id == action.id).all()
@@ -471,7 +459,7 @@ def delete_patient(patient_delete_data: DeletePatient, session: SessionDep = Ses
         session.delete(patient_db)
 
     session.commit()
-    return {"message": "Patient deleted successfully"}
+    return {"message": "Patient deleted successfully", "deleted": deleted}
 
 
 @router.get("/doctor")
@@ -597,38 +585,16 @@ def delete_video_management(video_del_data: DeleteVideo, session: SessionDep = S
     if not video_db:
         raise HTTPException(status_code=404, detail="Video not found")
 
-    if not video_del_data.force: # Soft delete
-        video_db.is_deleted = True
-        video_db.update_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        # Soft delete related actions if this video is an original video
-        if video_db.original_video:
-            actions = session.query(Action).filter(
-                Action.video_id == video_db.id, Action.is_deleted == False).all()
-            for action in actions:
-                action.is_deleted = True
-                action.update_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                # Soft delete stages and steps for this action
-                stages = session.query(Stage).filter(
-                    Stage.action_id == action.id, Stage.is_deleted == False).all()
-                for stage in stages:
-                    stage.is_deleted = True
-                    stage.update_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                    steps = session.query(StepsInfo).filter(
-                        StepsInfo.stage_id == stage.id, StepsInfo.is_deleted == False).all()
-                    for step in steps:
-                        step.is_deleted = True
-                        step.update_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                # Soft delete inference videos associated with this action
-                inference_videos = session.query(VideoPath).filter(
-                    VideoPath.action_id == action.id, VideoPath.inference_video == True, VideoPath.is_deleted == False).all()
-                for inf_vid in inference_videos:
-                    inf_vid.is_deleted = True
-                    inf_vid.update_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    deleted = None
+    if not video_del_data.force: # Soft delete, with its actions if this is an original video
+        deleted = soft_delete_video(session, video_db)
 
     else: # Hard delete
         # If it's an original video, delete its actions, stages, steps, and inference videos
         if video_db.original_video:
             actions = session.query(Action).filter(Action.video_id == video_del_data.video_id).all()
+            clear_action_summaries(session, [action.id for action in actions])
+            forget_deleted_actions(session, [action.id for action in actions])
             for action in actions:
                 # Delete inference videos for this action
                 session.query(VideoPath).filter(VideoPath.action_id == action.id, VideoPath.inference_video == True).delete(synchronize_session=False)
@@ -643,7 +609,7 @@ def delete_video_management(video_del_data: DeleteVideo, session: SessionDep = S
         session.delete(video_db)
 
     session.commit()
-    return {"message": "Video deleted successfully"}
+    return {"message": "Video deleted successfully", "deleted": deleted}
 
 
 @router.delete("/action") # This already exists
@@ -654,58 +620,11 @@ def delete_action_management(action_del_data: DeleteAction, session: SessionDep
     if not action_db:
         raise HTTPException(status_code=404, detail="Action not found")
 
-    # Soft delete action
-    action_db.is_deleted = True
-    action_db.update_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
-    # Soft delete associated stages and steps
-    stages = session.query(Stage).filter(
-        Stage.action_id == action_db.id, Stage.is_deleted == False).all()
-    for stage in stages:
-        stage.is_deleted = True
-        stage.update_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        steps = session.query(StepsInfo).filter(
-            StepsInfo.stage_id == stage.id, StepsInfo.is_deleted == False).all()
-        for step in steps:
-            step.is_deleted = True
-            step.update_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
-    # Soft delete associated inference videos
-    inference_videos = session.query(VideoPath).filter(
-        VideoPath.action_id == action_db.id, VideoPath.inference_video == True, VideoPath.is_deleted == False
-    ).all()
-    for inf_video in inference_videos:
-        inf_video.is_deleted = True
-        inf_video.update_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    
-    # If this action is a parent, soft delete child actions as well
-    if action_db.parent_id == action_db.id: # This indicates it's a primary action that might have sub-actions
-        child_actions = session.query(Action).filter(
-            Action.parent_id == action_db.id, Action.id != action_db.id, Action.is_deleted == False).all()
-        for child_action in child_actions:
-            child_action.is_deleted = True
-            child_action.update_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            child_stages = session.query(Stage).filter(
-                Stage.action_id == child_action.id, Stage.is_deleted == False).all()
-            for c_stage in child_stages:
-                c_stage.is_deleted = True
-                c_stage.update_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                c_steps = session.query(StepsInfo).filter(
-                    StepsInfo.stage_id == c_stage.id, StepsInfo.is_deleted == False).all()
-                for c_step in c_steps:
-                    c_step.is_deleted = True
-                    c_step.update_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            # Soft delete inference videos for child actions
-            child_inference_videos = session.query(VideoPath).filter(
-                VideoPath.action_id == child_action.id, VideoPath.inference_video == True, VideoPath.is_deleted == False
-            ).all()
-            for civ in child_inference_videos:
-                civ.is_deleted = True
-                civ.update_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
-
+    # Soft delete the action, its stages, steps and inference videos, and its
+    # child actions if it is a primary action
+    deleted = soft_delete_action(session, action_db)
     session.commit()
-    return {"message": "Action deleted successfully"}
+    return {"message": "Action deleted successfully", "deleted": deleted}
 
 
 @router.get("/dashboard/metrics", response_model=DashboardMetrics)
@@ -0,0 +1,25 @@
+from common.job_queue import queue_depth
+from common.metrics import prometheus_text, queue_metrics
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from models import Action, SessionDep
+from sqlalchemy import func
+
+router = APIRouter(tags=["metrics"], prefix="/metrics")
+
+
+def _collect(session) -> dict:
+    status_counts = dict(session.query(Action.status, func.count(Action.id)).filter(
+        Action.is_deleted == False).group_by(Action.status).all())
+    return queue_metrics(queue_depth(), status_counts)
+
+
+@router.get("/queue")
+def get_queue_metrics(session: SessionDep = SessionDep):
+    return _collect(session)
+
+
+@router.get("/queue/prometheus", response_class=PlainTextResponse)
+def get_queue_metrics_prometheus(session: SessionDep = SessionDep):
+    return PlainTextResponse(prometheus_text(_collect(session)),
+                             media_type="text/plain; version=0.0.4")
@@ -2,6 +2,7 @@ from datetime import datetime
 from typing import Optional
 from sqlalchemy import desc, asc
 
+from common.summary import load_patient_trends
 from fastapi import APIRouter, Body, Query
 from models import Doctors, Patients, SessionDep
 from pydantic import BaseModel
@@ -147,3 +148,12 @@ def get_patient_with_page(
         "page_size": page_size,
         "patients": [patient.to_dict() for patient in patients]
     }
+
+
+@router.get("/{patient_id}/trends")
+def get_patient_trends(patient_id: int, session: SessionDep = SessionDep):
+    patient = session.query(Patients.id).filter(
+        Patients.id == patient_id, Patients.is_deleted == False).first()
+    if not patient:
+        return {"message": "Patient not found"}
+    return load_patient_trends(session, patient_id)
@@ -1,17 +1,23 @@
 import os
 import uuid
-import shutil
-import tempfile
 from datetime import datetime
 
-from common.utils import convert_to_mp4, generate_thumbnail
+import anyio
+from common.cascade import forget_deleted_actions
+from common.content_store import checkout, store
+from common.ranges import FileRangeResponse
+from common.summary import clear_action_summaries
+from common.transcode import attach, source_path, submit as submit_transcode
+from common.uploads import (UploadLockLost, UploadOverflow, UploadWriter, append_upload, create_upload,
+                            delete_upload, get_upload, hash_file, lock_upload, unlock_upload)
+from common.utils import generate_thumbnail
 from config import video_dir
-from fastapi import APIRouter, Body, File, Request, UploadFile, HTTPException
+from fastapi import APIRouter, Body, File, Header, Request, Response, UploadFile, HTTPException
 from fastapi.responses import StreamingResponse, FileResponse
 from models import (Action, Doctors, Patients, SessionDep, Stage, StepsInfo,
                     VideoPath)
 from pydantic import BaseModel
-from starlette.concurrency import run_in_threadpool
+from starlette.requests import ClientDisconnect
 
 router = APIRouter(tags=["videos"], prefix="/videos")
 
@@ -22,6 +28,12 @@ class DeleteVideo(BaseModel):
     patient_id: int
 
 
+class CreateUpload(BaseModel):
+    patient_id: int
+    filename: str
+    size: int
+
+
 @router.delete("/delete_video")
 def delete_video(video: DeleteVideo = Body(...), session: SessionDep = SessionDep):
     doctor = session.query(Doctors).filter(
@@ -60,6 +72,8 @@ def delete_video(video: DeleteVideo = Body(...), session: SessionDep = SessionDe
     all_parent_actions = session.query(Action).filter(
         Action.parent_id == action_id, Action.is_deleted == False).all()
     all_actions.extend(all_parent_actions)
+    clear_action_summaries(session, [action_.id for action_ in all_actions])
+    forget_deleted_actions(session, [action_.id for action_ in all_actions])
     if not all_actions:
         session.commit()
         return {"message": "Video deleted successfully"}
@@ -83,106 +97,129 @@ def delete_video(video: DeleteVideo = Body(...), session: SessionDep = SessionDe
     return {"message": "Video deleted successfully"}
 
 
-@router.post("/upload/{patient_id}")
-# Use Depends() for SessionDep, make endpoint async
-async def upload_video(patient_id: int, video: UploadFile = File(...), session: SessionDep = SessionDep):
+SUPPORTED_FORMATS = ('.avi', '.mov', '.wmv', '.mkv', '.flv', '.mp4v', '.m4v', '.rmvb',
+                     '.webm', '.mpeg', '.mpg', '.ts', '.vob', '.mp4')
+
+
+def _check_patient(session, patient_id: int) -> None:
     patient = session.query(Patients).filter(
         Patients.id == patient_id, Patients.is_deleted == False).first()
     if not patient:
-        # Use HTTPException
         raise HTTPException(status_code=404, detail="Patient not found")
 
-    if not video.content_type or not video.content_type.startswith("video/"):
-        raise HTTPException(
-            status_code=400, detail="Invalid file content type")
 
-    # More robust format check (still relies on filename)
-    supported_formats = ('.avi', '.mov', '.wmv', '.mkv', '.flv', '.mp4v', '.m4v', '.rmvb',
-                         '.webm', '.mpeg', '.mpg', '.ts', '.vob', '.mp4')
-    original_filename = video.filename if video.filename else "unknown_video"
+def _video_extension(original_filename: str) -> str:
+    # Format check (still relies on filename)
     file_ext = os.path.splitext(original_filename)[1].lower()
-
     if not file_ext:
         raise HTTPException(status_code=400, detail="File has no extension")
-
-    if file_ext not in supported_formats:
+    if file_ext not in SUPPORTED_FORMATS:
         raise HTTPException(
             status_code=400, detail=f"Unsupported file format: {file_ext}")
+    return file_ext
+
 
+def _final_video_path(patient_id: int, original_filename: str) -> str:
     gen_uuid = uuid.uuid4().hex[:8]
     # Sanitize filename a bit
     safe_base_filename = os.path.splitext(original_filename)[
         0].replace(" ", "_").replace("/", "_")
-    final_filename_base = f"{patient_id}-{safe_base_filename}-{gen_uuid}"
-    # Define final path assuming MP4 output
-    final_video_path = os.path.join(
-        video_dir, "original", f"{final_filename_base}.mp4")
-    final_video_dir = os.path.dirname(final_video_path)
+    # Final path assuming MP4 output
+    return os.path.join(video_dir, "original", f"{patient_id}-{safe_base_filename}-{gen_uuid}.mp4")
+
+
+async def _register_upload(session, patient_id: int, original_filename: str, sha256: str,
+                           commit, discard) -> VideoPath:
+    """Move a fully received upload into place and record it.
+
+    ``commit(path)`` renames the staged bytes to ``path``. MP4 files are
+    ready at once; other formats are queued for the transcoding pool. Content
+    seen before is linked to its stored conversion and ``discard()`` drops
+    the staged copy.
+    """
+    file_ext = _video_extension(original_filename)
+    final_video_path = _final_video_path(patient_id, original_filename)
+    duplicate_of_converting = False
+    if await anyio.to_thread.run_sync(checkout, sha256, final_video_path):
+        discard()
+        status = "ready"
+    elif session.query(VideoPath.id).filter(VideoPath.content_hash == sha256,
+                                            VideoPath.status == "transcoding").first():
+        # linked when the conversion of the first copy ends
+        discard()
+        status = "transcoding"
+        duplicate_of_converting = True
+    elif file_ext != ".mp4":
+        # Keep the upload next to its target so a restart can resume the
+        # conversion; the transcoding pool converts it in the background.
+        source_video_path = source_path(final_video_path, file_ext)
+        await commit(source_video_path)
+        status = "transcoding"
+    else:
+        await commit(final_video_path)
+        await anyio.to_thread.run_sync(store, final_video_path, sha256)
+        status = "ready"
+
+    current_time = datetime.now()  # Use datetime objects if DB column type allows
+    new_video = VideoPath(
+        video_path=final_video_path,
+        patient_id=patient_id,
+        original_video=True,
+        inference_video=False,
+        is_deleted=False,
+        create_time=current_time,
+        update_time=current_time,
+        status=status,
+        content_hash=sha256
+    )
+    session.add(new_video)
+    session.commit()
+    session.refresh(new_video)  # Get the generated ID
+    if duplicate_of_converting:
+        # the first copy may have finished before this row was committed
+        await anyio.to_thread.run_sync(attach, new_video.id)
+        session.refresh(new_video)
+    elif status == "transcoding":
+        print(f"Queued conversion of {source_video_path} to {final_video_path}")
+        submit_transcode(new_video.id, source_video_path, final_video_path)
+    return new_video
+
+
+@router.post("/upload/{patient_id}")
+# Use Depends() for SessionDep, make endpoint async
+async def upload_video(patient_id: int, video: UploadFile = File(...), session: SessionDep = SessionDep):
+    _check_patient(session, patient_id)
+
+    if not video.content_type or not video.content_type.startswith("video/"):
+        raise HTTPException(
+            status_code=400, detail="Invalid file content type")
+
+    original_filename = video.filename if video.filename else "unknown_video"
+    file_ext = _video_extension(original_filename)
+    final_video_dir = os.path.join(video_dir, "original")
 
     # Ensure output directory exists
     os.makedirs(final_video_dir, exist_ok=True)
 
-    temp_file_path = None
+    writer = None
     try:
-        # --- Step 1: Save uploaded file to a temporary location ---
-        # Use NamedTemporaryFile for automatic cleanup on error (usually)
-        # Keep the original extension for the temporary file
-        # Use a temporary directory known to be on the same filesystem as final_video_dir
-        # if possible, otherwise shutil.move might perform a copy. /tmp is common.
-        with tempfile.NamedTemporaryFile(delete=False, suffix=file_ext, dir="/tmp") as temp_f:
-            temp_file_path = temp_f.name
-            size = 0
-            chunk_size = 1024 * 1024  # 1MB chunks
-            while True:
-                # Use await to read the async stream
-                chunk = await video.read(chunk_size)
-                if not chunk:
-                    break
-                size += len(chunk)
-                temp_f.write(chunk)
-            # Logging
-            print(f"Temporary file saved: {temp_file_path}, Size: {size}")
-
-        # --- Step 2: Convert if necessary OR move if already MP4 ---
-        if file_ext != ".mp4":
-            print(f"Converting {temp_file_path} to {final_video_path}...")
-            # Run the synchronous convert_to_mp4 (using FFmpeg) in a threadpool
-            # to avoid blocking the async event loop.
-            conversion_success = await run_in_threadpool(convert_to_mp4, temp_file_path, final_video_path)
-
-            if not conversion_success:
-                # convert_to_mp4 should ideally log its own errors
-                print(f"Conversion failed for {temp_file_path}")
-                raise HTTPException(
-                    status_code=500, detail="Video conversion failed")
-            else:
-                print(f"Conversion successful: {final_video_path}")
-                # Conversion done, original temp file can be removed now
-                os.remove(temp_file_path)
-                temp_file_path = None  # Mark as removed
-
-        else:
-            # It's already MP4, just move the temporary file to the final location
-            print(f"Moving {temp_file_path} to {final_video_path}...")
-            shutil.move(temp_file_path, final_video_path)
-            temp_file_path = None  # Mark as moved
-
-        # --- Step 3: Add record to database ---
-        current_time = datetime.now()  # Use datetime objects if DB column type allows
-        new_video = VideoPath(
-            video_path=final_video_path,
-            patient_id=patient_id,
-            original_video=True,
-            inference_video=False,
-            is_deleted=False,
-            create_time=current_time,
-            update_time=current_time
-        )
-        session.add(new_video)
-        session.commit()
-        session.refresh(new_video)  # Get the generated ID
-
-        return {"message": "Video uploaded successfully", "video_id": new_video.id}
+        # --- Step 1: Stream the upload into a staging file in final_video_dir ---
+        # Disk writes and hashing run off the event loop; staging on the same
+        # filesystem makes Step 2 a rename instead of a second copy.
+        writer = UploadWriter(final_video_dir, file_ext)
+        chunk_size = 1024 * 1024  # 1MB chunks
+        while chunk := await video.read(chunk_size):
+            await writer.write(chunk)
+        print(f"Upload staged: {writer.path}, Size: {writer.size}, SHA-256: {writer.sha256}")
+
+        # --- Step 2: Move into place, queue a conversion unless MP4, add the record ---
+        new_video = await _register_upload(session, patient_id, original_filename, writer.sha256,
+                                           writer.commit, writer.abort)
+        size, sha256 = writer.size, writer.sha256
+        writer = None  # Committed
+
+        return {"message": "Video uploaded successfully", "video_id": new_video.id, "status": new_video.status,
+                "size": size, "sha256": sha256}
 
     except HTTPException as http_exc:
         # If an HTTPException was raised earlier, re-raise it
@@ -196,18 +233,127 @@ async def upload_video(patient_id: int, video: UploadFile = File(...), session:
         raise HTTPException(
             status_code=500, detail=f"An internal error occurred: {e}")
     finally:
-        # --- Cleanup: Ensure temporary file is deleted if something went wrong ---
-        if temp_file_path and os.path.exists(temp_file_path):
-            print(f"Cleaning up leftover temporary file: {temp_file_path}")
+        # --- Cleanup: Ensure the staging file is deleted if something went wrong ---
+        if writer:
+            print(f"Cleaning up leftover staging file: {writer.path}")
             try:
-                os.remove(temp_file_path)
+                writer.abort()
             except OSError as rm_err:
                 print(
-                    f"Error removing temporary file {temp_file_path}: {rm_err}")
+                    f"Error removing staging file {writer.path}: {rm_err}")
         # Ensure the underlying file stream is closed
         await video.close()
 
 
+def _find_upload(upload_id: str) -> dict:
+    upload = get_upload(upload_id)
+    if not upload:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    return upload
+
+
+@router.post("/uploads")
+def create_resumable_upload(upload: CreateUpload = Body(...), session: SessionDep = SessionDep):
+    _check_patient(session, upload.patient_id)
+    _video_extension(upload.filename)
+    if upload.size <= 0:
+        raise HTTPException(status_code=400, detail="Upload size must be positive")
+    final_video_dir = os.path.join(video_dir, "original")
+    os.makedirs(final_video_dir, exist_ok=True)
+    upload_id = create_upload(final_video_dir, upload.patient_id, upload.filename, upload.size)
+    return {"message": "Upload created successfully", "upload_id": upload_id, "offset": 0, "size": upload.size}
+
+
+@router.head("/uploads/{upload_id}")
+def get_upload_offset(upload_id: str):
+    upload = _find_upload(upload_id)
+    return Response(headers={"Upload-Offset": str(upload["offset"]), "Upload-Length": str(upload["size"]),
+                             "Cache-Control": "no-store"})
+
+
+@router.get("/uploads/{upload_id}")
+def get_resumable_upload(upload_id: str):
+    upload = _find_upload(upload_id)
+    return {"upload_id": upload_id, "patient_id": upload["patient_id"], "filename": upload["filename"],
+            "offset": upload["offset"], "size": upload["size"]}
+
+
+@router.patch("/uploads/{upload_id}")
+async def append_resumable_upload(upload_id: str, request: Request,
+                                  upload_offset: int = Header(..., alias="Upload-Offset",
+                                                              description="本次数据块在文件中的起始偏移")):
+    _find_upload(upload_id)
+    token = lock_upload(upload_id)
+    if not token:
+        raise HTTPException(status_code=409, detail="Upload is being written by another request")
+    try:
+        # read under the lock: the previous writer may have just finished
+        upload = _find_upload(upload_id)
+        if upload_offset != upload["offset"]:
+            raise HTTPException(status_code=409, detail=f"Upload offset is {upload['offset']}, not {upload_offset}")
+        length = request.headers.get("content-length")
+        if length and length.isdigit() and int(length) > upload["size"] - upload["offset"]:
+            raise UploadOverflow()
+        offset = await append_upload(upload, request.stream(), token)
+    except UploadOverflow:
+        raise HTTPException(status_code=413, detail=f"Upload is larger than its declared size {upload['size']}")
+    except UploadLockLost:
+        raise HTTPException(status_code=409, detail="Upload lock expired while the request was stalled")
+    except ClientDisconnect:
+        # what arrived is kept; the client resumes from the next HEAD
+        return Response(status_code=204)
+    finally:
+        unlock_upload(upload_id, token)
+    return {"message": "Chunk stored successfully", "offset": offset, "size": upload["size"]}
+
+
+@router.post("/uploads/{upload_id}/finalize")
+async def finalize_resumable_upload(upload_id: str, session: SessionDep = SessionDep):
+    _find_upload(upload_id)
+    token = lock_upload(upload_id)
+    if not token:
+        raise HTTPException(status_code=409, detail="Upload is being written by another request")
+    try:
+        upload = _find_upload(upload_id)
+        if upload["offset"] != upload["size"]:
+            raise HTTPException(status_code=409, detail=f"Upload incomplete: {upload['offset']} of {upload['size']} bytes")
+        _check_patient(session, upload["patient_id"])
+        sha256 = await anyio.to_thread.run_sync(hash_file, upload["path"])
+
+        async def commit(destination):
+            await anyio.to_thread.run_sync(os.replace, upload["path"], destination)
+
+        new_video = await _register_upload(session, upload["patient_id"], upload["filename"], sha256,
+                                           commit, lambda: os.remove(upload["path"]))
+        delete_upload(upload, remove_file=False)
+    finally:
+        unlock_upload(upload_id, token)
+    return {"message": "Video uploaded successfully", "video_id": new_video.id, "status": new_video.status,
+            "size": upload["size"], "sha256": sha256}
+
+
+@router.delete("/uploads/{upload_id}")
+def delete_resumable_upload(upload_id: str):
+    upload = _find_upload(upload_id)
+    token = lock_upload(upload_id)
+    if not token:
+        raise HTTPException(status_code=409, detail="Upload is being written by another request")
+    try:
+        delete_upload(upload)
+    finally:
+        unlock_upload(upload_id, token)
+    return {"message": "Upload deleted successfully"}
+
+
+@router.get("/status/{video_id}")
+def get_video_status(video_id: int, session: SessionDep = SessionDep):
+    video = session.query(VideoPath).filter(
+        VideoPath.id == video_id, VideoPath.is_deleted == False).first()
+    if not video:
+        return {"message": "Video not found"}
+    return {"video_id": video.id, "status": video.status, "update_time": video.update_time}
+
+
 @router.get("/video/{video_type}/{patient_id}/{video_id}")
 def get_video(video_type: str, patient_id: int, video_id: int, session: SessionDep = SessionDep):
     if video_type not in ["original", "inference"]:
@@ -250,30 +396,8 @@ def stream_video(video_type: str, patient_id: int, video_id: int, session: Sessi
     if not video:
         return {"message": "Video not found"}
 
-    video_path = video.video_path
-    file_size = os.path.getsize(video_path)
-
-    if range_header := request.headers.get("range", None):
-        start, end = range_header.replace("bytes=", "").split("-")
-        start = int(start)
-        end = int(end) if end else file_size - 1
-        chunk_size = end - start + 1
-
-        def iter_file():
-            with open(video_path, "rb") as f:
-                f.seek(start)
-                while chunk := f.read(chunk_size):
-                    yield chunk
-
-        headers = {
-            "Content-Range": f"bytes {start}-{end}/{file_size}",
-            "Accept-Ranges": "bytes",
-            "Content-Type": "video/mp4",
-        }
-
-        return StreamingResponse(iter_file(), status_code=206, headers=headers)
-
-    return StreamingResponse(open(video_path, "rb"), media_type="video/mp4")
+    # Range, If-Range and conditional requests are handled by the response
+    return FileRangeResponse(video.video_path, request.headers)
 
 
 @router.get("/thumbnail_image/{video_type}/{patient_id}/{video_id}")
@@ -1,16 +1,24 @@
+import asyncio
 import os
 
 from apis.actions import router as action_router
 from apis.dashboard import router as dashboard_router
 from apis.doctors import router as doctor_router
 from apis.management import router as management_router
+from apis.metrics import router as metrics_router
 from apis.patients import router as patient_router
 from apis.table import router as table_router
 from apis.videos import router as video_router
-from config import listen_port, postgres_uri, video_dir
+from common.etag import NotModified
+from common.job_queue import ensure_group, migrate_legacy_queue
+from common.progress import flush_progress, run_progress_flusher
+from common.transcode import resume_transcoding, shutdown as shutdown_transcoding
+from common.uploads import clean_stale_uploads
+from config import listen_port, postgres_uri, upload_staging_ttl, video_dir
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
+import models
 from models import Roles, create_db_and_tables
 from sqlmodel import Session, create_engine
 
@@ -23,6 +31,7 @@ app.include_router(patient_router, prefix="/api/v1", tags=["patients"])
 app.include_router(video_router, prefix="/api/v1", tags=["videos"])
 app.include_router(table_router, prefix="/api/v1", tags=["tables"])
 app.include_router(management_router, prefix="/api/v1", tags=["management"])
+app.include_router(metrics_router, prefix="/api/v1", tags=["metrics"])
 
 origins = ["*"]
 app.add_middleware(
@@ -31,6 +40,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag"],
 )
 
 
@@ -42,6 +52,11 @@ async def jwt_exception_handler(request, exc):
     )
 
 
+@app.exception_handler(NotModified)
+async def not_modified_handler(request, exc):
+    return Response(status_code=304, headers={"ETag": exc.etag, "Cache-Control": "private, no-cache"})
+
+
 @app.on_event("startup")
 async def startup_event():
     if not os.path.exists(f"{video_dir}/original"):
@@ -50,7 +65,16 @@ async def startup_event():
         os.makedirs(f"{video_dir}/flipped")
     if not os.path.exists(f"{video_dir}/inference"):
         os.makedirs(f"{video_dir}/inference")
+    if removed := clean_stale_uploads(f"{video_dir}/original", upload_staging_ttl):
+        print(f"Removed {removed} abandoned upload staging files")
     create_db_and_tables()
+    ensure_group()
+    if moved := migrate_legacy_queue():
+        print(f"Moved {moved} jobs from the legacy action lists to the job stream")
+    app.state.progress_flusher = asyncio.create_task(
+        run_progress_flusher(lambda: Session(models.engine)))
+    if resumed := resume_transcoding():
+        print(f"Resumed {resumed} interrupted video conversions")
 
     engine = create_engine(postgres_uri)
     with Session(engine) as session:
@@ -64,6 +88,15 @@ async def startup_event():
             session.commit()
             print("Admin role created successfully")
 
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    app.state.progress_flusher.cancel()
+    shutdown_transcoding()
+    with Session(models.engine) as session:
+        flush_progress(session)
+
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run("app:app", host="0.0.0.0", port=listen_port, reload=True)
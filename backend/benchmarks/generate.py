@@ -0,0 +1,93 @@
+"""Synthetic gait data for the dashboard/table benchmarks.
+
+Values are resampled from ``test-data.json`` so the distributions have the
+same shape as a real analysis; metrics missing from that file get plausible
+ranges. Rows are written with explicit ids into an empty database.
+"""
+import json
+import os
+import random
+from datetime import datetime, timedelta
+
+from common.summary import refresh_action_summary
+from models import Action, Patients, Stage, StepsInfo, VideoPath
+from sqlalchemy import insert
+
+TEST_DATA = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "test-data.json")
+
+
+def _load_pools() -> dict[str, list[float]]:
+    with open(TEST_DATA) as f:
+        data = json.load(f)["data"]
+    # test-data.json is in centimetres; StepsInfo stores metres
+    return {
+        "step_length": [item["size"] / 100 for item in data["step_length"]],
+        "step_speed": [item["size"] / 1000 for item in data["step_speed"]],
+        "stride_length": [item["size"] / 100 for item in data["step_stride"]],
+        "hip_min_degree": [item["low"] for item in data["step_hip_degree"]],
+        "hip_max_degree": [item["high"] for item in data["step_hip_degree"]],
+    }
+
+
+def _sample(rnd: random.Random, pool: list[float]) -> float:
+    return rnd.choice(pool) * rnd.uniform(0.9, 1.1)
+
+
+def generate(session, patients: int, actions: int, stages: int, steps: int, seed: int = 0) -> dict:
+    """Insert ``patients`` x ``actions`` x ``stages`` x ``steps`` rows.
+
+    Summaries are refreshed per action the way ``update_action`` does, so
+    the table endpoints see the same state as after a real ingest.
+    """
+    rnd = random.Random(seed)
+    pools = _load_pools()
+    start = datetime(2024, 1, 1)
+    patient_rows, video_rows, action_rows, stage_rows, step_rows = [], [], [], [], []
+    action_ids = []
+    for p in range(1, patients + 1):
+        patient_rows.append(dict(id=p, username=f"bench-{p}", age=60, gender="男", case_id=f"BENCH{p:06d}",
+                                 doctor_id=None, notes=None, create_time=f"{start:%Y-%m-%d %H:%M:%S}",
+                                 update_time=f"{start:%Y-%m-%d %H:%M:%S}", is_deleted=False))
+        parent_id = None
+        for a in range(actions):
+            action_id = len(action_rows) + 1
+            parent_id = parent_id or action_id
+            created = f"{start + timedelta(days=a, minutes=p):%Y-%m-%d %H:%M:%S}"
+            video_rows.append(dict(id=action_id, patient_id=p, action_id=action_id, original_video=True,
+                                   inference_video=False, video_path=f"/data/videos/original/bench-{action_id}.mp4",
+                                   create_time=created, update_time=created, is_deleted=False))
+            action_rows.append(dict(id=action_id, parent_id=parent_id, video_id=action_id, patient_id=p,
+                                    status="finished", progress="finished", create_time=created,
+                                    update_time=created, is_deleted=False))
+            action_ids.append(action_id)
+            for s in range(stages):
+                stage_id = len(stage_rows) + 1
+                stage_rows.append(dict(id=stage_id, action_id=action_id, stage_n=s, start_frame=s * 1000,
+                                       end_frame=s * 1000 + 999, create_time=created, update_time=created,
+                                       is_deleted=False))
+                for n in range(steps):
+                    step_rows.append(dict(
+                        id=len(step_rows) + 1, stage_id=stage_id, step_id=n + 1,
+                        start_frame=s * 1000 + n * 10, end_frame=s * 1000 + n * 10 + 9,
+                        step_length=_sample(rnd, pools["step_length"]),
+                        step_speed=_sample(rnd, pools["step_speed"]),
+                        front_leg="left" if n % 2 == 0 else "right",
+                        support_time=rnd.uniform(0.4, 0.9),
+                        liftoff_height=rnd.uniform(0.02, 0.15),
+                        hip_min_degree=_sample(rnd, pools["hip_min_degree"]),
+                        hip_max_degree=_sample(rnd, pools["hip_max_degree"]),
+                        first_step=n == 0,
+                        steps_diff=rnd.uniform(0.0, 0.2),
+                        stride_length=_sample(rnd, pools["stride_length"]),
+                        step_width=rnd.uniform(0.05, 0.25),
+                        create_time=created, update_time=created, is_deleted=False))
+
+    for model, rows in ((Patients, patient_rows), (VideoPath, video_rows), (Action, action_rows),
+                        (Stage, stage_rows), (StepsInfo, step_rows)):
+        if rows:
+            session.execute(insert(model), rows)
+    for action_id in action_ids:
+        refresh_action_summary(session, action_id)
+    session.commit()
+    return {"patient_ids": list(range(1, patients + 1)), "action_ids": action_ids,
+            "steps": len(step_rows)}
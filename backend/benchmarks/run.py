@@ -0,0 +1,191 @@
+"""Latency / SQL / memory benchmark for the dashboard and table endpoints.
+
+Run from the ``backend`` directory::
+
+    python -m benchmarks.run --sizes 1x2x2x50,4x4x4x200 --output bench.json
+    python -m benchmarks.run --baseline bench.json --output bench-new.json
+
+``--sizes`` lists ``patients x actions x stages x steps`` data sets, each
+generated into a fresh database (SQLite by default, or ``--db`` for a local
+Postgres). For every endpoint the report holds latency percentiles, SQL
+statements per request and peak Python memory, so two reports from different
+commits can be compared with ``--baseline``. A reachable Redis is required;
+``--cold`` invalidates the chart cache before every request.
+"""
+import argparse
+import contextlib
+import io
+import json
+import platform
+import statistics
+import subprocess
+import time
+import tracemalloc
+from datetime import datetime
+
+import models
+from app import app
+from benchmarks.generate import generate
+from common.cache import bump_data_version
+from common.summary import METRIC_COLUMNS
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+from sqlalchemy.pool import StaticPool
+from sqlmodel import Session, SQLModel, create_engine
+
+CHARTS = ("step_hip_degree", "step_width", "step_length", "step_speed",
+          "step_stride", "step_difference", "support_time", "liftoff_height")
+
+
+def endpoints(action_id: int, parent_id: int, patient_id: int) -> dict[str, str]:
+    urls = {}
+    for chart in CHARTS:
+        urls[f"dashboard/{chart}"] = f"/api/v1/dashboard/{chart}/{action_id}?max_points=0"
+        urls[f"dashboard/{chart}/raw"] = f"/api/v1/dashboard/{chart}/raw/{action_id}?max_points=0"
+    urls["dashboard/bundle"] = f"/api/v1/dashboard/bundle/{action_id}?max_points=0"
+    urls["dashboard/compare/raw"] = f"/api/v1/dashboard/compare/raw/step_length?parent_id={parent_id}"
+    for metric in METRIC_COLUMNS:
+        urls[f"table/{metric}"] = f"/api/v1/table/{metric}/{action_id}"
+    urls["table/summary"] = f"/api/v1/table/summary/{action_id}"
+    urls["patients/trends"] = f"/api/v1/patients/{patient_id}/trends"
+    return urls
+
+
+def _percentile(values: list[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+def _make_engine(db: str):
+    if db.startswith("sqlite"):
+        return create_engine(db, connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    return create_engine(db)
+
+
+def bench_size(db: str, size: tuple[int, int, int, int], iterations: int, warmup: int,
+               cold: bool = False) -> list[dict]:
+    engine = _make_engine(db)
+    SQLModel.metadata.drop_all(engine)
+    SQLModel.metadata.create_all(engine)
+    statements = [0]
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _count(*args):
+        statements[0] += 1
+
+    def get_session():
+        with Session(engine) as session:
+            yield session
+
+    with Session(engine) as session, contextlib.redirect_stdout(io.StringIO()):
+        data = generate(session, *size)
+
+    app.dependency_overrides[models.get_session] = get_session
+    client = TestClient(app)
+    action_ids = data["action_ids"]
+    results = []
+    try:
+        for name, _ in endpoints(0, 0, 0).items():
+            latencies, counts, peaks = [], [], []
+            for i in range(warmup + iterations):
+                action_id = action_ids[i % len(action_ids)]
+                patient_id = data["patient_ids"][i % len(data["patient_ids"])]
+                url = endpoints(action_id, action_id, patient_id)[name]
+                if cold:
+                    bump_data_version([action_id])
+                statements[0] = 0
+                tracemalloc.start()
+                started = time.perf_counter()
+                with contextlib.redirect_stdout(io.StringIO()):
+                    response = client.get(url)
+                elapsed = (time.perf_counter() - started) * 1000
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                if response.status_code != 200:
+                    raise RuntimeError(f"{url} returned {response.status_code}: {response.text[:200]}")
+                if i >= warmup:
+                    latencies.append(elapsed)
+                    counts.append(statements[0])
+                    peaks.append(peak)
+            results.append({
+                "size": dict(zip(("patients", "actions", "stages", "steps"), size)),
+                "total_steps": data["steps"],
+                "endpoint": name,
+                "latency_ms": {
+                    "p50": round(_percentile(latencies, 0.5), 3),
+                    "p90": round(_percentile(latencies, 0.9), 3),
+                    "p99": round(_percentile(latencies, 0.99), 3),
+                    "mean": round(statistics.fmean(latencies), 3),
+                },
+                "sql_statements": round(statistics.fmean(counts), 2),
+                "peak_memory_kb": round(max(peaks) / 1024, 1),
+            })
+    finally:
+        app.dependency_overrides.pop(models.get_session, None)
+        engine.dispose()
+    return results
+
+
+def compare(report: dict, baseline: dict) -> None:
+    previous = {(json.dumps(r["size"], sort_keys=True), r["endpoint"]): r for r in baseline["results"]}
+    print(f"{'size':<16}{'endpoint':<34}{'p50 ms':>10}{'base':>10}{'ratio':>8}{'sql':>7}{'base':>7}")
+    for result in report["results"]:
+        key = (json.dumps(result["size"], sort_keys=True), result["endpoint"])
+        if key not in previous:
+            continue
+        old = previous[key]
+        size = "x".join(str(v) for v in result["size"].values())
+        ratio = result["latency_ms"]["p50"] / old["latency_ms"]["p50"] if old["latency_ms"]["p50"] else float("nan")
+        print(f"{size:<16}{result['endpoint']:<34}{result['latency_ms']['p50']:>10.2f}"
+              f"{old['latency_ms']['p50']:>10.2f}{ratio:>8.2f}{result['sql_statements']:>7.1f}"
+              f"{old['sql_statements']:>7.1f}")
+
+
+def _git_revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db", default="sqlite://",
+                        help="SQLAlchemy URL of a scratch database; it is wiped for every size")
+    parser.add_argument("--sizes", default="1x2x2x50,2x4x4x200",
+                        help="comma separated PATIENTSxACTIONSxSTAGESxSTEPS")
+    parser.add_argument("--iterations", type=int, default=30)
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--cold", action="store_true",
+                        help="bump the action data version before every request so cached charts are rebuilt")
+    parser.add_argument("--output", default="bench.json")
+    parser.add_argument("--baseline", help="previous report to compare against")
+    args = parser.parse_args()
+
+    sizes = [tuple(int(part) for part in size.split("x")) for size in args.sizes.split(",")]
+    report = {
+        "meta": {
+            "revision": _git_revision(),
+            "created": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "python": platform.python_version(),
+            "db": args.db.split("@")[-1],
+            "iterations": args.iterations,
+            "warmup": args.warmup,
+            "cold": args.cold,
+        },
+        "results": [],
+    }
+    for size in sizes:
+        print(f"benchmarking {'x'.join(map(str, size))} ...")
+        report["results"].extend(bench_size(args.db, size, args.iterations, args.warmup, args.cold))
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"report written to {args.output}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(report, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+import threading
+import time
+from collections import OrderedDict
+
+from common.utils import get_redis_connection
+from config import chart_cache_size, chart_cache_ttl
+from redis.exceptions import RedisError
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+redis_conn = get_redis_connection()
+
+
+class LRUCache:
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._items:
+                return None
+            self._items.move_to_end(key)
+            return self._items[key]
+
+    def set(self, key, value):
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+
+local_charts = LRUCache(chart_cache_size)
+
+
+def _version_key(action_id: int) -> str:
+    return f"action_data_version:{action_id}"
+
+
+def _new_token() -> str:
+    return f"{time.time_ns():x}"
+
+
+def get_data_version(action_id: int) -> str | None:
+    """Opaque token that changes whenever the steps of an action change.
+
+    ``None`` means Redis is unreachable and nothing should be cached. A
+    missing key (never bumped, or lost with a Redis restart) gets a fresh
+    token rather than a fixed default, so entries cached under a token from
+    before the loss are never served again.
+    """
+    key = _version_key(action_id)
+    try:
+        version = redis_conn.get(key)
+        if version is None:
+            # NX: concurrent first readers all end up with the same token
+            redis_conn.set(key, _new_token(), nx=True)
+            version = redis_conn.get(key)
+    except RedisError as e:
+        print(f"Redis unavailable, chart cache bypassed: {e}")
+        return None
+    return version.decode() if version else None
+
+
+def bump_data_version(action_ids) -> None:
+    # A fresh token orphans every cached entry of the action; old entries
+    # simply age out of both tiers
+    token = _new_token()
+    try:
+        pipe = redis_conn.pipeline(transaction=False)
+        for action_id in action_ids:
+            pipe.set(_version_key(action_id), token)
+        pipe.execute()
+    except RedisError as e:
+        print(f"Failed to bump data version of actions {list(action_ids)}: {e}")
+
+
+def mark_actions_changed(session, action_ids) -> None:
+    """Bump the data version of these actions once ``session`` commits."""
+    session.info.setdefault("changed_action_ids", set()).update(action_ids)
+
+
+@event.listens_for(Session, "after_commit")
+def _bump_changed_actions(session):
+    if action_ids := session.info.pop("changed_action_ids", None):
+        bump_data_version(action_ids)
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_changed_actions(session):
+    session.info.pop("changed_action_ids", None)
+
+
+def cached_chart(chart_type: str, action_id: int, build):
+    """Return the rendered chart from the process LRU, then Redis, else ``build()``."""
+    version = get_data_version(action_id)
+    if version is None:
+        return build()
+    key = f"chart:{chart_type}:{action_id}:{version}"
+    if (value := local_charts.get(key)) is not None:
+        return value
+    try:
+        value = redis_conn.get(key)
+    except RedisError:
+        value = None
+    if value is not None:
+        value = value.decode()
+        local_charts.set(key, value)
+        return value
+    value = build()
+    local_charts.set(key, value)
+    try:
+        redis_conn.set(key, value, ex=chart_cache_ttl)
+    except RedisError:
+        pass
+    return value
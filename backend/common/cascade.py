@@ -0,0 +1,88 @@
+from datetime import datetime
+
+from common.job_queue import cancel_job
+from common.progress import forget_action
+from common.summary import clear_action_summaries
+from models import Action, Patients, Stage, StepsInfo, VideoPath
+from redis.exceptions import RedisError
+from sqlalchemy import event, select, update
+from sqlalchemy.orm import Session
+
+
+def _soft_delete(session, model, *criteria) -> int:
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    result = session.execute(
+        update(model).where(model.is_deleted == False, *criteria).values(is_deleted=True, update_time=now),
+        execution_options={"synchronize_session": False})
+    return result.rowcount
+
+
+def soft_delete_actions(session, *criteria) -> dict:
+    """Soft delete the live actions matching ``criteria`` with their stages,
+    steps and inference videos.
+
+    One UPDATE per level, each selecting its rows through an ``IN``
+    subquery on the actions, children first so the subqueries still see the
+    actions as live. Nothing is committed; returns the affected row counts.
+    """
+    actions = select(Action.id).where(Action.is_deleted == False, *criteria)
+    action_ids = list(session.scalars(actions))
+    counts = {"actions": 0, "stages": 0, "steps": 0, "videos": 0}
+    if not action_ids:
+        return counts
+    stages = select(Stage.id).where(Stage.action_id.in_(actions))
+    counts["steps"] = _soft_delete(session, StepsInfo, StepsInfo.stage_id.in_(stages))
+    counts["stages"] = _soft_delete(session, Stage, Stage.action_id.in_(actions))
+    counts["videos"] = _soft_delete(session, VideoPath, VideoPath.action_id.in_(actions),
+                                    VideoPath.inference_video == True)
+    counts["actions"] = _soft_delete(session, Action, Action.id.in_(action_ids))
+    clear_action_summaries(session, action_ids)
+    forget_deleted_actions(session, action_ids)
+    return counts
+
+
+def forget_deleted_actions(session, action_ids) -> None:
+    """Cancel the jobs and drop the buffered progress of deleted actions once
+    ``session`` commits; hard deletes call this themselves."""
+    session.info.setdefault("deleted_action_ids", set()).update(action_ids)
+
+
+def soft_delete_videos(session, *criteria) -> int:
+    return _soft_delete(session, VideoPath, *criteria)
+
+
+def soft_delete_action(session, action: Action) -> dict:
+    # a primary action (its own parent) takes its re-analyses with it
+    if action.parent_id == action.id:
+        return soft_delete_actions(session, (Action.id == action.id) | (Action.parent_id == action.id))
+    return soft_delete_actions(session, Action.id == action.id)
+
+
+def soft_delete_video(session, video: VideoPath) -> dict:
+    counts = {"actions": 0, "stages": 0, "steps": 0, "videos": 0}
+    if video.original_video:
+        counts = soft_delete_actions(session, Action.video_id == video.id)
+    counts["videos"] += _soft_delete(session, VideoPath, VideoPath.id == video.id)
+    return counts
+
+
+def soft_delete_patient(session, patient_id: int) -> dict:
+    counts = soft_delete_actions(session, Action.patient_id == patient_id)
+    counts["videos"] += _soft_delete(session, VideoPath, VideoPath.patient_id == patient_id)
+    counts["patients"] = _soft_delete(session, Patients, Patients.id == patient_id)
+    return counts
+
+
+@event.listens_for(Session, "after_commit")
+def _cancel_deleted_jobs(session):
+    for action_id in session.info.pop("deleted_action_ids", ()):
+        try:
+            cancel_job(action_id)
+            forget_action(action_id)
+        except RedisError as e:
+            print(f"Failed to cancel the job of deleted action {action_id}: {e}")
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_deleted_jobs(session):
+    session.info.pop("deleted_action_ids", None)
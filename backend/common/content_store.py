@@ -0,0 +1,75 @@
+import os
+import shutil
+
+from config import video_dir
+from models import VideoPath
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+# Converted uploads keyed by the SHA-256 of the bytes as uploaded. Every
+# VideoPath of the same content is a hard link to its object, so each row
+# keeps its own path while the bytes are stored once.
+OBJECTS_DIR = os.path.join(video_dir, "objects")
+
+
+def object_path(content_hash: str) -> str:
+    return os.path.join(OBJECTS_DIR, content_hash[:2], f"{content_hash}.mp4")
+
+
+def _link(source: str, destination: str) -> None:
+    try:
+        os.link(source, destination)
+    except FileExistsError:
+        pass
+    except OSError as e:
+        # e.g. video_dir spread over several filesystems: still no new conversion
+        print(f"Cannot hard link {source} to {destination}, copying instead: {e}")
+        shutil.copyfile(source, destination)
+
+
+def store(path: str, content_hash: str) -> None:
+    """Add a converted video to the store under its upload's hash."""
+    target = object_path(content_hash)
+    if not os.path.exists(target):
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        _link(path, target)
+
+
+def checkout(content_hash: str, path: str) -> bool:
+    """Link the stored conversion of ``content_hash`` to ``path``; False if
+    the content has not been converted yet."""
+    source = object_path(content_hash)
+    if not os.path.exists(source):
+        return False
+    _link(source, path)
+    return True
+
+
+def references(session, content_hash: str) -> int:
+    # soft deleted rows keep their file, so they still count
+    return session.query(VideoPath).filter(VideoPath.content_hash == content_hash).count()
+
+
+@event.listens_for(Session, "before_flush")
+def _collect_released_content(session, flush_context, instances):
+    for obj in session.deleted:
+        if isinstance(obj, VideoPath) and obj.content_hash:
+            session.info.setdefault("released_content", set()).add(obj.content_hash)
+
+
+@event.listens_for(Session, "after_commit")
+def _remove_unreferenced_objects(session):
+    released = session.info.pop("released_content", None)
+    if not released:
+        return
+    with Session(session.get_bind()) as check:
+        for content_hash in released:
+            target = object_path(content_hash)
+            if not references(check, content_hash) and os.path.exists(target):
+                print(f"Removing unreferenced video object {target}")
+                os.remove(target)
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_released_content(session):
+    session.info.pop("released_content", None)
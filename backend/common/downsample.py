@@ -0,0 +1,76 @@
+import numpy as np
+
+
+def lttb_indices(y: np.ndarray, threshold: int) -> np.ndarray:
+    """Largest-Triangle-Three-Buckets over an evenly spaced series.
+
+    Returns the sorted indices of the ``threshold`` points that best keep the
+    visual shape of ``y``. The first and last points are always kept.
+    """
+    n = len(y)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    y = np.nan_to_num(np.asarray(y, dtype=np.float64))
+    x = np.arange(n, dtype=np.float64)
+    # threshold - 2 buckets between the fixed first and last point
+    edges = np.floor(np.linspace(1, n - 1, threshold - 1)).astype(np.int64)
+
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        if i + 2 < len(edges):
+            next_x = x[edges[i + 1]:edges[i + 2]].mean()
+            next_y = y[edges[i + 1]:edges[i + 2]].mean()
+        else:
+            next_x, next_y = x[-1], y[-1]
+        # twice the triangle area for every candidate of the bucket at once
+        area = np.abs((x[a] - next_x) * (y[start:end] - y[a])
+                      - (x[a] - x[start:end]) * (next_y - y[a]))
+        a = start + int(np.argmax(area))
+        selected[i + 1] = a
+    return selected
+
+
+def downsample_indices(series: list[np.ndarray], max_points: int) -> np.ndarray:
+    """Indices that keep every series within ``max_points`` points in total.
+
+    Each series' global minimum and maximum are kept first, so clinically
+    relevant extremes survive, and count towards the budget; what is left is
+    shared between the series' LTTB selections.
+    """
+    n = len(series[0]) if series else 0
+    if not max_points or n <= max_points:
+        return np.arange(n)
+    extremes = []
+    for values in series:
+        if not np.isnan(values).all():
+            extremes += [int(np.nanargmin(values)), int(np.nanargmax(values))]
+    extremes = list(dict.fromkeys(extremes))[:max_points]
+    remaining = max_points - len(extremes)
+    budget = remaining // len(series)
+    if budget >= 3:
+        keep = [lttb_indices(values, budget) for values in series]
+    elif remaining:
+        # too few points left for LTTB: spread them evenly
+        keep = [np.unique(np.linspace(0, n - 1, remaining).round().astype(np.int64))]
+    else:
+        keep = []
+    return np.unique(np.concatenate(keep + [np.array(extremes, dtype=np.int64)]))
+
+
+def downsample_steps(steps: dict[str, np.ndarray], max_points: int) -> dict[str, np.ndarray]:
+    """Slice every column of ``load_action_steps`` output to the LTTB selection.
+
+    The numeric measurement columns drive the selection; ``step_no`` is sliced
+    along with them, so labels still show the original step numbers.
+    """
+    series = [values for column, values in steps.items()
+              if column != "step_no" and values.dtype == np.float64]
+    if not series:
+        return steps
+    indices = downsample_indices(series, max_points)
+    if len(indices) == len(steps["step_no"]):
+        return steps
+    return {column: values[indices] for column, values in steps.items()}
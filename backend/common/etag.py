@@ -0,0 +1,58 @@
+import hashlib
+
+from common.cache import get_data_version
+from fastapi import Request, Response
+from models import Action, ActionMetricSummary, SessionDep
+from sqlalchemy import select
+
+
+class NotModified(Exception):
+    def __init__(self, etag: str):
+        self.etag = etag
+
+
+def _matches(if_none_match: str, etag: str) -> bool:
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags
+
+
+def _stored_stamp(session, action_id: int) -> str:
+    # two primary key reads; every path that changes an action's steps
+    # touches both rows (see common.summary) in the same transaction
+    row = session.execute(select(
+        select(Action.update_time).where(Action.id == action_id).scalar_subquery(),
+        select(ActionMetricSummary.update_time).where(
+            ActionMetricSummary.action_id == action_id).scalar_subquery(),
+    )).one()
+    return "|".join(str(value) for value in row)
+
+
+def action_etag(request: Request, response: Response, session: SessionDep):
+    """Router dependency giving ``{action_id}`` routes conditional GET support.
+
+    The ETag is derived from the stored update times of the action and its
+    summary plus its data version, the request path and query, so it
+    changes when ``update_action`` or a delete path touches the action, even
+    if Redis lost the version in between. A matching ``If-None-Match``
+    short-circuits with 304 before the handler loads anything.
+    """
+    action_id = request.path_params.get("action_id")
+    if action_id is None or request.method != "GET":
+        return
+    try:
+        action_id = int(action_id)
+    except ValueError:
+        # left to the route's own validation
+        return
+    version = get_data_version(action_id)
+    if version is None:
+        return
+    stamp = _stored_stamp(session, action_id)
+    digest = hashlib.sha1(
+        f"{request.url.path}?{request.url.query}#{version}#{stamp}".encode()).hexdigest()[:16]
+    etag = f'W/"{action_id}-{digest}"'
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and _matches(if_none_match, etag):
+        raise NotModified(etag)
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = "private, no-cache"
@@ -0,0 +1,127 @@
+import asyncio
+import json
+
+import redis.asyncio as aioredis
+from common.utils import get_redis_connection
+from config import redis_db, redis_host, redis_port
+from redis.exceptions import RedisError
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+redis_conn = get_redis_connection()
+
+# One channel per action. Each process subscribes to all of them once with
+# EVENT_PATTERN and filters per SSE client in Python (Subscription.wants);
+# the per-action name only helps when watching traffic with redis-cli.
+EVENT_CHANNEL = "action_events:{patient_id}:{action_id}"
+EVENT_PATTERN = "action_events:*"
+SUBSCRIBER_QUEUE_SIZE = 100
+# how long a new stream waits for the Redis subscription before going on without it
+SUBSCRIBE_TIMEOUT = 5
+
+
+def action_event(action) -> dict:
+    return {"action_id": action.id, "patient_id": action.patient_id, "status": action.status,
+            "progress": action.progress, "update_time": action.update_time}
+
+
+def publish_action_events(events) -> None:
+    try:
+        pipe = redis_conn.pipeline(transaction=False)
+        for item in events:
+            channel = EVENT_CHANNEL.format(patient_id=item["patient_id"], action_id=item["action_id"])
+            pipe.publish(channel, json.dumps(item, ensure_ascii=False))
+        pipe.execute()
+    except RedisError as e:
+        print(f"Failed to publish action events: {e}")
+
+
+def mark_action_event(session, action) -> None:
+    """Publish the current status/progress of ``action`` once ``session`` commits."""
+    session.info.setdefault("action_events", {})[action.id] = action_event(action)
+
+
+@event.listens_for(Session, "after_commit")
+def _publish_action_events(session):
+    if events := session.info.pop("action_events", None):
+        publish_action_events(events.values())
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_action_events(session):
+    session.info.pop("action_events", None)
+
+
+class Subscription:
+    def __init__(self, patient_id: int | None, action_id: int | None):
+        self.patient_id = patient_id
+        self.action_id = action_id
+        self.queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+
+    def wants(self, event: dict) -> bool:
+        return (self.patient_id is None or event["patient_id"] == self.patient_id) \
+            and (self.action_id is None or event["action_id"] == self.action_id)
+
+    def put(self, event: dict) -> None:
+        if self.queue.full():
+            # a slow client loses its oldest update, not the newest
+            self.queue.get_nowait()
+        self.queue.put_nowait(event)
+
+
+class EventBroker:
+    """One Redis subscription per process, fanned out to every SSE client.
+
+    The listener starts with the first subscriber and reconnects on its own
+    if Redis goes away. ``ready`` waits until Redis has confirmed the
+    subscription, after which no published event can be missed.
+    """
+
+    def __init__(self):
+        self.subscriptions = set()
+        self._task = None
+        self._subscribed = asyncio.Event()
+
+    def subscribe(self, patient_id: int | None = None, action_id: int | None = None) -> Subscription:
+        subscription = Subscription(patient_id, action_id)
+        self.subscriptions.add(subscription)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._listen())
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        self.subscriptions.discard(subscription)
+
+    async def ready(self, timeout: float = SUBSCRIBE_TIMEOUT) -> bool:
+        try:
+            await asyncio.wait_for(self._subscribed.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def _listen(self) -> None:
+        while self.subscriptions:
+            client = aioredis.Redis(host=redis_host, port=redis_port, db=redis_db)
+            try:
+                async with client.pubsub() as pubsub:
+                    await pubsub.psubscribe(EVENT_PATTERN)
+                    while self.subscriptions:
+                        message = await pubsub.get_message(timeout=1.0)
+                        if message and message["type"] == "psubscribe":
+                            self._subscribed.set()
+                        elif message and message["type"] == "pmessage":
+                            self._dispatch(json.loads(message["data"]))
+            except (RedisError, OSError) as e:
+                print(f"Action event listener lost Redis, retrying: {e}")
+                await asyncio.sleep(1)
+            finally:
+                self._subscribed.clear()
+                await client.aclose()
+
+    def _dispatch(self, event: dict) -> None:
+        for subscription in list(self.subscriptions):
+            if subscription.wants(event):
+                subscription.put(event)
+
+
+broker = EventBroker()
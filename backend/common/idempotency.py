@@ -0,0 +1,66 @@
+import asyncio
+import hashlib
+import json
+
+from common.utils import get_redis_connection
+from config import idempotency_ttl
+from redis.exceptions import RedisError
+
+redis_conn = get_redis_connection()
+
+IDEMPOTENCY_PREFIX = "idempotency:"
+PENDING = "pending"
+SAVE_ATTEMPTS = 3
+
+
+class KeyReused(Exception):
+    """The key was first used for a request with a different payload."""
+
+
+def fingerprint(payload) -> str:
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, ensure_ascii=False).encode()).hexdigest()
+
+
+def reserve(key: str, payload_hash: str) -> tuple[bool, dict | None]:
+    """Claim an idempotency key for a request about to run.
+
+    Returns ``(True, None)`` when the caller owns the key, ``(False,
+    response)`` when an earlier request with this key already finished and
+    ``(False, None)`` while that earlier request is still running. Raises
+    KeyReused when that earlier request had another payload.
+    """
+    redis_key = f"{IDEMPOTENCY_PREFIX}{key}"
+    if redis_conn.set(redis_key, json.dumps({"state": PENDING, "payload": payload_hash}),
+                      nx=True, ex=idempotency_ttl):
+        return True, None
+    value = redis_conn.get(redis_key)
+    if value is None:
+        return False, None
+    entry = json.loads(value)
+    if entry["payload"] != payload_hash:
+        raise KeyReused()
+    if entry["state"] == PENDING:
+        return False, None
+    return False, entry["response"]
+
+
+async def save(key: str, payload_hash: str, response: dict) -> None:
+    """Remember the response of a request whose effects are committed.
+
+    Retried briefly. If Redis still refuses, the key stays pending until it
+    expires: retries are answered 409, which is safe, where releasing it
+    would let a retry create everything again.
+    """
+    value = json.dumps({"state": "done", "payload": payload_hash, "response": response}, ensure_ascii=False)
+    for attempt in range(SAVE_ATTEMPTS):
+        try:
+            redis_conn.set(f"{IDEMPOTENCY_PREFIX}{key}", value, ex=idempotency_ttl)
+            return
+        except RedisError as e:
+            print(f"Failed to save the response of idempotency key {key} (attempt {attempt + 1}): {e}")
+            await asyncio.sleep(0.1 * (attempt + 1))
+
+
+def release(key: str) -> None:
+    # the request failed; let a retry run it again
+    redis_conn.delete(f"{IDEMPOTENCY_PREFIX}{key}")
@@ -0,0 +1,157 @@
+from datetime import datetime
+
+from common.steps import columnar_steps, load_action_steps
+from common.summary import SUMMARY_COLUMNS, merge_moments, step_moments, store_action_moments
+from models import Stage, StepsInfo
+from sqlalchemy import insert
+
+STEP_FIELDS = ("start_frame", "end_frame", "step_length", "step_speed", "front_leg",
+               "support_time", "liftoff_height", "hip_min_degree", "hip_max_degree",
+               "first_step", "steps_diff", "stride_length", "step_width")
+
+
+def _stage_errors(stage) -> list[str]:
+    if stage.start_frame > stage.end_frame:
+        return [f"stage {stage.stage_n}: start_frame > end_frame"]
+    return []
+
+
+def _step_errors(stage_n: int, step_id: int, step) -> list[str]:
+    if step.start_frame > step.end_frame:
+        return [f"stage {stage_n} step {step_id}: start_frame > end_frame"]
+    return []
+
+
+def validate_action_data(stages) -> list[str]:
+    """Check a whole result payload before anything is written.
+
+    Returns a list of human readable problems; an empty list means the
+    payload can be ingested.
+    """
+    errors = []
+    seen = set()
+    for stage in stages:
+        if stage.stage_n in seen:
+            errors.append(f"stage {stage.stage_n}: duplicate stage_n")
+        seen.add(stage.stage_n)
+        errors.extend(_stage_errors(stage))
+        for n, step in enumerate(stage.steps_info or []):
+            errors.extend(_step_errors(stage.stage_n, n + 1, step))
+    return errors
+
+
+def _insert_stages(session, action_id: int, stages, now: str) -> list[int]:
+    # One multi-row INSERT ... RETURNING; ids come back in parameter order
+    return session.scalars(
+        insert(Stage).returning(Stage.id, sort_by_parameter_order=True),
+        [{"action_id": action_id, "stage_n": stage.stage_n, "start_frame": stage.start_frame,
+          "end_frame": stage.end_frame, "is_deleted": False, "create_time": now, "update_time": now}
+         for stage in stages]
+    ).all()
+
+
+def _step_row(stage_id: int, step_id: int, step, now: str) -> dict:
+    return {"stage_id": stage_id, "step_id": step_id,
+            **{field: getattr(step, field) for field in STEP_FIELDS},
+            "is_deleted": False, "create_time": now, "update_time": now}
+
+
+def ingest_action_results(session, action_id: int, stages) -> int:
+    """Insert the stages and steps of an analysis in bulk.
+
+    Stages go in as one multi-row ``INSERT ... RETURNING id``; their steps
+    follow as a single executemany which SQLAlchemy batches into multi-row
+    inserts. Nothing is committed here so the caller controls the
+    transaction. Returns the number of steps written.
+    """
+    stages = sorted(stages, key=lambda x: x.stage_n)
+    if not stages:
+        return 0
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    stage_ids = _insert_stages(session, action_id, stages, now)
+    step_rows = [_step_row(stage_id, n + 1, step, now)
+                 for stage_id, stage in zip(stage_ids, stages)
+                 for n, step in enumerate(stage.steps_info or [])]
+    if step_rows:
+        session.execute(insert(StepsInfo), step_rows)
+    return len(step_rows)
+
+
+class StreamingIngest:
+    """Incremental counterpart of ``ingest_action_results``.
+
+    Stages and steps are added one record at a time; every step belongs to
+    the most recent stage. Pending rows are written and committed once
+    ``batch_size`` steps are buffered, together with a refreshed summary, so
+    the dashboard sees results while the upload is still running and memory
+    stays bounded by the batch size. The summary is kept as running moments:
+    steps already stored are read once, at the first batch, and every later
+    batch only merges in its own rows.
+    """
+
+    def __init__(self, session, action_id: int, batch_size: int):
+        self.session = session
+        self.action_id = action_id
+        self.batch_size = batch_size
+        self.stages = 0
+        self.steps = 0
+        self.batches = 0
+        self._seen = set()
+        self._stage = None
+        self._stored = None
+        self._moments = None
+        self._step_count = 0
+        self._step_id = 0
+        self._pending_stages = []
+        self._pending_steps = []
+
+    def add_stage(self, stage) -> None:
+        errors = _stage_errors(stage)
+        if stage.stage_n in self._seen:
+            errors.append(f"stage {stage.stage_n}: duplicate stage_n")
+        if errors:
+            raise ValueError("; ".join(errors))
+        self._seen.add(stage.stage_n)
+        self._stage = stage
+        self._step_id = 0
+        self._pending_stages.append(stage)
+        self.stages += 1
+
+    def add_step(self, step) -> None:
+        if self._stage is None:
+            raise ValueError("step record before any stage record")
+        self._step_id += 1
+        errors = _step_errors(self._stage.stage_n, self._step_id, step)
+        if errors:
+            raise ValueError("; ".join(errors))
+        # stage is resolved to its id at flush time
+        self._pending_steps.append((self._stage, self._step_id, step))
+        self.steps += 1
+        if len(self._pending_steps) >= self.batch_size:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self._pending_stages and not self._pending_steps:
+            return
+        if self._moments is None:
+            existing = load_action_steps(self.session, self.action_id, SUMMARY_COLUMNS)
+            self._moments = step_moments(existing)
+            self._step_count = len(existing["step_no"])
+        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        # steps may still be pending for the stage stored by the last batch
+        stage_ids = {id(self._stored[0]): self._stored[1]} if self._stored else {}
+        if self._pending_stages:
+            ids = _insert_stages(self.session, self.action_id, self._pending_stages, now)
+            stage_ids.update((id(stage), stage_id) for stage, stage_id in zip(self._pending_stages, ids))
+        self._stored = (self._stage, stage_ids[id(self._stage)])
+        rows = [_step_row(stage_ids[id(stage)], step_id, step, now)
+                for stage, step_id, step in self._pending_steps]
+        if rows:
+            self.session.execute(insert(StepsInfo), rows)
+            self._moments = merge_moments(self._moments, step_moments(columnar_steps(rows, SUMMARY_COLUMNS)))
+            self._step_count += len(rows)
+        store_action_moments(self.session, self.action_id, self._moments, self._step_count)
+        self.session.commit()
+        self._pending_stages = []
+        self._pending_steps = []
+        self.batches += 1
@@ -0,0 +1,387 @@
+from common.metrics import record_enqueued, record_finished, record_started, throughput
+from common.utils import get_redis_connection
+from config import job_max_deliveries, job_visibility_timeout
+from redis.exceptions import ResponseError
+
+redis_conn = get_redis_connection()
+
+JOB_STREAM = "action_jobs"
+JOB_GROUP = "pose_workers"
+DEAD_STREAM = "action_jobs:dead"
+# action_id -> stream entry id, so a job can be cancelled without a scan
+JOB_ENTRIES = "action_jobs:entries"
+
+LEGACY_LISTS = ("running_actions", "waiting_actions")
+
+# Scheduler: jobs wait here until a worker asks for one and only then move
+# onto the stream. Classes are served strictly in this order; inside a class
+# tenants (doctors or departments) share workers by weight.
+PRIORITIES = ("urgent", "high", "normal", "low")
+DEFAULT_PRIORITY = "normal"
+DEFAULT_TENANT = "default"
+SCHED_JOB = "action_sched:job:"
+SCHED_WEIGHTS = "action_sched:weights"
+# video_id -> action ids whose jobs wait for that video to finish transcoding
+DEFERRED_PREFIX = "action_sched:deferred:"
+
+
+def _queue_key(priority: str) -> str:
+    return f"action_sched:queue:{priority}"
+
+
+def _finish_key(priority: str) -> str:
+    return f"action_sched:finish:{priority}"
+
+
+def _vtime_key(priority: str) -> str:
+    return f"action_sched:vtime:{priority}"
+
+
+# Weighted fair queueing: a job's tag is its tenant's previous tag (or the
+# class's virtual time, if the tenant was idle) plus 1 / weight. Jobs leave in
+# tag order, so a tenant with 50 queued videos only gets its share.
+_schedule = redis_conn.register_script("""
+local weight = tonumber(redis.call('HGET', KEYS[4], ARGV[2]) or '1')
+local vtime = tonumber(redis.call('GET', KEYS[3]) or '0')
+local last = tonumber(redis.call('HGET', KEYS[2], ARGV[2]) or '0')
+local tag = math.max(vtime, last) + 1 / weight
+redis.call('HSET', KEYS[2], ARGV[2], tag)
+redis.call('ZADD', KEYS[1], tag, ARGV[1])
+return tostring(tag)
+""")
+
+# Pop the head of the first non-empty class, append it to the stream and
+# deliver it to the asking consumer in one step, so a job is never in neither
+# place and no other worker can read it first. Returns the entry as
+# {id, {field, value, ...}}.
+_dispatch = redis_conn.register_script("""
+local function deliver()
+  local reply = redis.call('XREADGROUP', 'GROUP', ARGV[2], ARGV[3], 'COUNT', 1, 'STREAMS', KEYS[1], '>')
+  if reply and #reply > 0 then
+    return reply[1][2][1]
+  end
+  return false
+end
+-- an entry an older worker appended but never read
+local entry = deliver()
+if entry then
+  return entry
+end
+for i = 3, #KEYS, 2 do
+  local popped = redis.call('ZPOPMIN', KEYS[i])
+  if #popped > 0 then
+    redis.call('SET', KEYS[i + 1], popped[2])
+    local job_key = ARGV[1] .. popped[1]
+    local fields = redis.call('HGETALL', job_key)
+    redis.call('DEL', job_key)
+    local entry_id = redis.call('XADD', KEYS[1], '*', unpack(fields))
+    redis.call('HSET', KEYS[2], popped[1], entry_id)
+    return deliver()
+  end
+end
+return false
+""")
+
+
+# Remove a job from its class queue or from the stream, wherever _dispatch
+# has put it; atomic with _dispatch, so the job cannot move in between.
+_cancel = redis_conn.register_script("""
+local priority = redis.call('HGET', KEYS[3], 'priority')
+if priority then
+  redis.call('ZREM', ARGV[2] .. priority, ARGV[1])
+  redis.call('DEL', KEYS[3])
+  return 1
+end
+local entry_id = redis.call('HGET', KEYS[2], ARGV[1])
+if not entry_id then
+  return 0
+end
+redis.call('XACK', KEYS[1], ARGV[3], entry_id)
+redis.call('XDEL', KEYS[1], entry_id)
+redis.call('HDEL', KEYS[2], ARGV[1])
+return 1
+""")
+
+
+def ensure_group() -> None:
+    try:
+        redis_conn.xgroup_create(JOB_STREAM, JOB_GROUP, id="0", mkstream=True)
+    except ResponseError as e:
+        if "BUSYGROUP" not in str(e):
+            raise
+
+
+def job_name(patient_id: int, action_id: int, video_id: int) -> str:
+    # the "{patient}-{action}-{video}" form workers already understand
+    return f"{patient_id}-{action_id}-{video_id}"
+
+
+def boost(priority: str) -> str:
+    return PRIORITIES[max(PRIORITIES.index(priority) - 1, 0)]
+
+
+def _schedule_job(action_id: int, tenant: str, priority: str, client=None) -> None:
+    _schedule(keys=[_queue_key(priority), _finish_key(priority), _vtime_key(priority), SCHED_WEIGHTS],
+              args=[action_id, tenant], client=client)
+
+
+def _save_job(pipe, patient_id: int, action_id: int, video_id: int, tenant: str, priority: str) -> None:
+    pipe.hset(f"{SCHED_JOB}{action_id}", mapping={
+        "patient_id": patient_id, "action_id": action_id, "video_id": video_id,
+        "name": job_name(patient_id, action_id, video_id),
+        "tenant": tenant, "priority": priority,
+    })
+
+
+def enqueue_jobs(jobs) -> None:
+    """Schedule ``(patient_id, action_id, video_id, tenant, priority)`` jobs
+    in one round trip."""
+    pipe = redis_conn.pipeline()
+    for patient_id, action_id, video_id, tenant, priority in jobs:
+        _save_job(pipe, patient_id, action_id, video_id, tenant, priority)
+        _schedule_job(action_id, tenant, priority, client=pipe)
+    pipe.execute()
+    record_enqueued(*[job[1] for job in jobs])
+
+
+def defer_jobs(jobs) -> None:
+    """Hold jobs back until ``release_deferred`` is called for their video."""
+    pipe = redis_conn.pipeline()
+    for patient_id, action_id, video_id, tenant, priority in jobs:
+        _save_job(pipe, patient_id, action_id, video_id, tenant, priority)
+        pipe.sadd(f"{DEFERRED_PREFIX}{video_id}", action_id)
+    pipe.execute()
+
+
+def _take_deferred(video_id: int) -> list[int]:
+    # SMEMBERS and DEL in one transaction: only one caller gets the jobs
+    pipe = redis_conn.pipeline()
+    pipe.smembers(f"{DEFERRED_PREFIX}{video_id}")
+    pipe.delete(f"{DEFERRED_PREFIX}{video_id}")
+    return [int(action_id) for action_id in pipe.execute()[0]]
+
+
+def release_deferred(video_id: int) -> list[int]:
+    """Schedule the jobs waiting for ``video_id``; returns their action ids.
+    Jobs cancelled in the meantime are skipped."""
+    action_ids = _take_deferred(video_id)
+    pipe = redis_conn.pipeline(transaction=False)
+    for action_id in action_ids:
+        pipe.hmget(f"{SCHED_JOB}{action_id}", "tenant", "priority")
+    jobs = pipe.execute()
+    released = []
+    pipe = redis_conn.pipeline()
+    for action_id, (tenant, priority) in zip(action_ids, jobs):
+        if priority is not None:
+            _schedule_job(action_id, tenant.decode(), priority.decode(), client=pipe)
+            released.append(action_id)
+    pipe.execute()
+    record_enqueued(*released)
+    return released
+
+
+def drop_deferred(video_id: int) -> list[int]:
+    """Forget the jobs waiting for a video that will never be ready."""
+    action_ids = _take_deferred(video_id)
+    if action_ids:
+        redis_conn.delete(*[f"{SCHED_JOB}{action_id}" for action_id in action_ids])
+    return action_ids
+
+
+def enqueue_job(patient_id: int, action_id: int, video_id: int,
+                tenant: str = DEFAULT_TENANT, priority: str = DEFAULT_PRIORITY) -> None:
+    enqueue_jobs([(patient_id, action_id, video_id, tenant, priority)])
+
+
+def set_job_priority(action_id: int, priority: str) -> bool:
+    """Move a job that is still waiting to another priority class."""
+    job_key = f"{SCHED_JOB}{action_id}"
+    current, tenant, video_id = redis_conn.hmget(job_key, "priority", "tenant", "video_id")
+    if current is None:
+        return False
+    if redis_conn.sismember(f"{DEFERRED_PREFIX}{video_id.decode()}", action_id):
+        # scheduled with the new priority once its video is ready
+        redis_conn.hset(job_key, "priority", priority)
+        return True
+    if not redis_conn.zrem(_queue_key(current.decode()), action_id):
+        return False
+    redis_conn.hset(job_key, "priority", priority)
+    _schedule_job(action_id, tenant.decode(), priority)
+    return True
+
+
+def set_tenant_weight(tenant: str, weight: float) -> None:
+    redis_conn.hset(SCHED_WEIGHTS, tenant, weight)
+
+
+def _job(entry_id, fields: dict, deliveries: int = 1) -> dict:
+    fields = {k.decode(): v.decode() for k, v in fields.items()}
+    return {
+        "entry_id": entry_id.decode() if isinstance(entry_id, bytes) else entry_id,
+        "patient_id": int(fields["patient_id"]),
+        "action_id": int(fields["action_id"]),
+        "video_id": int(fields["video_id"]),
+        "name": fields["name"],
+        "priority": fields.get("priority", DEFAULT_PRIORITY),
+        "tenant": fields.get("tenant", DEFAULT_TENANT),
+        "deliveries": deliveries,
+    }
+
+
+def _bury(job: dict) -> None:
+    # Poison job: keep it for inspection and take it out of the group
+    redis_conn.xadd(DEAD_STREAM, {"name": job["name"], "action_id": job["action_id"],
+                                  "entry_id": job["entry_id"], "deliveries": job["deliveries"]})
+    _remove(job["action_id"], job["entry_id"])
+
+
+def _remove(action_id: int, entry_id: str) -> None:
+    pipe = redis_conn.pipeline()
+    pipe.xack(JOB_STREAM, JOB_GROUP, entry_id)
+    pipe.xdel(JOB_STREAM, entry_id)
+    pipe.hdel(JOB_ENTRIES, action_id)
+    pipe.execute()
+
+
+def claim_job(consumer: str) -> tuple[dict | None, list[dict]]:
+    """Hand the next job to ``consumer``.
+
+    Jobs whose worker has not acknowledged or extended them within
+    ``job_visibility_timeout`` seconds are reclaimed first; a job delivered
+    more than ``job_max_deliveries`` times is moved to the dead stream.
+    Otherwise the scheduler picks the next waiting job.
+    Returns the claimed job (or ``None``) and the jobs given up on.
+    """
+    ensure_group()
+    dead = []
+    idle = job_visibility_timeout * 1000
+    while True:
+        # Redis finds the oldest timed-out entry itself, one round trip
+        # however many live jobs are pending ahead of it.
+        pending = redis_conn.xpending_range(JOB_STREAM, JOB_GROUP, min="-", max="+", count=1, idle=idle)
+        if not pending:
+            break
+        entry_id = pending[0]["message_id"]
+        # min_idle_time makes this a no-op if another worker got there first
+        claimed = redis_conn.xclaim(JOB_STREAM, JOB_GROUP, consumer, min_idle_time=idle,
+                                    message_ids=[entry_id])
+        if not claimed:
+            continue
+        if not claimed[0][1]:
+            # deleted while pending
+            redis_conn.xack(JOB_STREAM, JOB_GROUP, entry_id)
+            continue
+        job = _job(entry_id, claimed[0][1], pending[0]["times_delivered"] + 1)
+        if job["deliveries"] <= job_max_deliveries:
+            record_started(job["action_id"])
+            return job, dead
+        _bury(job)
+        dead.append(job)
+
+    keys = [JOB_STREAM, JOB_ENTRIES]
+    for priority in PRIORITIES:
+        keys += [_queue_key(priority), _vtime_key(priority)]
+    entry = _dispatch(keys=keys, args=[SCHED_JOB, JOB_GROUP, consumer])
+    if not entry:
+        return None, dead
+    entry_id, fields = entry
+    job = _job(entry_id, dict(zip(fields[::2], fields[1::2])))
+    record_started(job["action_id"])
+    return job, dead
+
+
+def extend_job(action_id: int, consumer: str) -> bool:
+    """Reset the visibility timeout of a job the consumer is still working on."""
+    entry_id = redis_conn.hget(JOB_ENTRIES, action_id)
+    if not entry_id:
+        return False
+    return bool(redis_conn.xclaim(JOB_STREAM, JOB_GROUP, consumer, min_idle_time=0,
+                                  message_ids=[entry_id], justid=True))
+
+
+def finish_job(action_id: int) -> bool:
+    """Acknowledge a job a worker is done with; no-op for unknown jobs."""
+    entry_id = redis_conn.hget(JOB_ENTRIES, action_id)
+    if not entry_id:
+        return False
+    _remove(action_id, entry_id.decode())
+    record_finished(action_id)
+    return True
+
+
+def cancel_job(action_id: int) -> bool:
+    """Drop a job wherever it is, without a scan."""
+    return bool(_cancel(keys=[JOB_STREAM, JOB_ENTRIES, f"{SCHED_JOB}{action_id}"],
+                        args=[action_id, _queue_key(""), JOB_GROUP]))
+
+
+def queue_depth() -> dict[str, int]:
+    pipe = redis_conn.pipeline(transaction=False)
+    for priority in PRIORITIES:
+        pipe.zcard(_queue_key(priority))
+    pipe.hlen(JOB_ENTRIES)
+    pipe.xlen(DEAD_STREAM)
+    *waiting, running, dead = pipe.execute()
+    return {**{f"waiting_{priority}": size for priority, size in zip(PRIORITIES, waiting)},
+            "running": running, "dead": dead}
+
+
+def queue_status(action_ids) -> dict[int, dict]:
+    """Where each action stands in the queue, with a throughput based ETA.
+
+    Position is the number of jobs the scheduler would hand out first: every
+    job of a higher class plus the job's rank in its own class, i.e. one
+    ZCARD per class and one ZRANK per job. Jobs arriving later in a higher
+    class, or from a tenant with a smaller share used, can still overtake.
+    """
+    action_ids = list(action_ids)
+    pipe = redis_conn.pipeline(transaction=False)
+    for action_id in action_ids:
+        pipe.hget(f"{SCHED_JOB}{action_id}", "priority")
+        pipe.hexists(JOB_ENTRIES, action_id)
+    for priority in PRIORITIES:
+        pipe.zcard(_queue_key(priority))
+    replies = pipe.execute()
+    sizes = dict(zip(PRIORITIES, replies[2 * len(action_ids):]))
+
+    waiting = {}
+    pipe = redis_conn.pipeline(transaction=False)
+    for i, action_id in enumerate(action_ids):
+        if replies[2 * i] is not None:
+            waiting[action_id] = replies[2 * i].decode()
+            pipe.zrank(_queue_key(waiting[action_id]), action_id)
+    ranks = dict(zip(waiting, pipe.execute()))
+
+    rate = throughput()
+    statuses = {}
+    for i, action_id in enumerate(action_ids):
+        if action_id in waiting and ranks[action_id] is not None:
+            priority = waiting[action_id]
+            ahead = ranks[action_id] + sum(sizes[p] for p in PRIORITIES[:PRIORITIES.index(priority)])
+            statuses[action_id] = {
+                "state": "waiting", "priority": priority, "position": ahead + 1, "ahead": ahead,
+                "eta_seconds": round((ahead + 1) / rate) if rate else None,
+            }
+        elif action_id in waiting:
+            # held back until its video has been transcoded
+            statuses[action_id] = {"state": "deferred", "priority": waiting[action_id], "position": None,
+                                   "ahead": None, "eta_seconds": None}
+        elif replies[2 * i + 1]:
+            statuses[action_id] = {"state": "running", "position": 0, "ahead": 0, "eta_seconds": 0}
+        else:
+            statuses[action_id] = {"state": "not_queued", "position": None, "ahead": None, "eta_seconds": None}
+    return statuses
+
+
+def migrate_legacy_queue() -> int:
+    """Move jobs still sitting in the old ``waiting_actions`` /
+    ``running_actions`` lists into the scheduler; running ones are redone."""
+    moved = 0
+    for key in LEGACY_LISTS:
+        while (name := redis_conn.lpop(key)) is not None:
+            patient_id, action_id, video_id = (int(part) for part in name.decode().split("-"))
+            if not redis_conn.hexists(JOB_ENTRIES, action_id) \
+                    and not redis_conn.exists(f"{SCHED_JOB}{action_id}"):
+                enqueue_job(patient_id, action_id, video_id)
+                moved += 1
+    return moved
@@ -0,0 +1,149 @@
+import time
+
+from common.utils import get_redis_connection
+from redis.exceptions import RedisError
+
+redis_conn = get_redis_connection()
+
+# per-action lifecycle timestamps: enqueued, started, finished
+TIMES_PREFIX = "action_metrics:times:"
+TIMES_TTL = 7 * 24 * 60 * 60
+HISTOGRAM_PREFIX = "action_metrics:histogram:"
+# finish timestamps of the last hour, for the sliding throughput windows
+FINISHED = "action_metrics:finished"
+
+BUCKETS = (5, 15, 30, 60, 120, 300, 600, 1200, 1800, 3600, 7200)
+WINDOWS = {"1m": 60, "5m": 5 * 60, "15m": 15 * 60, "1h": 60 * 60}
+# jobs the ETA rate is measured over
+THROUGHPUT_SAMPLES = 50
+
+
+def _bucket(seconds: float) -> str:
+    for bound in BUCKETS:
+        if seconds <= bound:
+            return str(bound)
+    return "+Inf"
+
+
+def _observe(pipe, histogram: str, seconds: float) -> None:
+    key = f"{HISTOGRAM_PREFIX}{histogram}"
+    pipe.hincrby(key, _bucket(seconds), 1)
+    pipe.hincrbyfloat(key, "sum", seconds)
+    pipe.hincrby(key, "count", 1)
+
+
+def _safely(record):
+    # metrics must never break the queue itself
+    def wrapper(*args):
+        try:
+            record(*args)
+        except RedisError as e:
+            print(f"Failed to record queue metrics: {e}")
+    return wrapper
+
+
+@_safely
+def record_enqueued(*action_ids: int) -> None:
+    now = time.time()
+    pipe = redis_conn.pipeline()
+    for action_id in action_ids:
+        key = f"{TIMES_PREFIX}{action_id}"
+        pipe.delete(key)
+        pipe.hset(key, "enqueued", now)
+        pipe.expire(key, TIMES_TTL)
+    pipe.execute()
+
+
+@_safely
+def record_started(action_id: int) -> None:
+    key = f"{TIMES_PREFIX}{action_id}"
+    now = time.time()
+    enqueued, first_start = redis_conn.hmget(key, "enqueued", "started")
+    pipe = redis_conn.pipeline()
+    # a reclaimed job restarts its run time but has only waited once
+    if enqueued and not first_start:
+        _observe(pipe, "wait", now - float(enqueued))
+    pipe.hset(key, "started", now)
+    pipe.expire(key, TIMES_TTL)
+    pipe.execute()
+
+
+@_safely
+def record_finished(action_id: int) -> None:
+    key = f"{TIMES_PREFIX}{action_id}"
+    now = time.time()
+    started = redis_conn.hget(key, "started")
+    pipe = redis_conn.pipeline()
+    if started:
+        _observe(pipe, "run", now - float(started))
+    pipe.hset(key, "finished", now)
+    pipe.zadd(FINISHED, {f"{action_id}:{now}": now})
+    pipe.zremrangebyscore(FINISHED, "-inf", now - max(WINDOWS.values()))
+    pipe.execute()
+
+
+def action_times(action_id: int) -> dict:
+    values = redis_conn.hgetall(f"{TIMES_PREFIX}{action_id}")
+    return {k.decode(): float(v) for k, v in values.items()}
+
+
+def throughput() -> float | None:
+    """Jobs finished per second over the most recent ``THROUGHPUT_SAMPLES``
+    jobs of the last hour."""
+    times = [score for _, score in redis_conn.zrevrange(FINISHED, 0, THROUGHPUT_SAMPLES - 1, withscores=True)]
+    if len(times) < 2 or times[0] <= times[-1]:
+        return None
+    return (len(times) - 1) / (times[0] - times[-1])
+
+
+def _histogram(name: str) -> dict:
+    values = {k.decode(): float(v) for k, v in redis_conn.hgetall(f"{HISTOGRAM_PREFIX}{name}").items()}
+    cumulative, buckets = 0, {}
+    for bound in [str(bound) for bound in BUCKETS] + ["+Inf"]:
+        cumulative += int(values.get(bound, 0))
+        buckets[bound] = cumulative
+    return {"buckets": buckets, "sum": round(values.get("sum", 0.0), 3), "count": int(values.get("count", 0))}
+
+
+def queue_metrics(depth: dict, status_counts: dict) -> dict:
+    """Snapshot of histograms and throughput, plus the depth and status
+    counts supplied by the caller."""
+    now = time.time()
+    pipe = redis_conn.pipeline(transaction=False)
+    for seconds in WINDOWS.values():
+        pipe.zcount(FINISHED, now - seconds, "+inf")
+    counts = pipe.execute()
+    return {
+        "depth": depth,
+        "status_counts": status_counts,
+        "wait_seconds": _histogram("wait"),
+        "run_seconds": _histogram("run"),
+        "throughput": {window: {"finished": count, "per_minute": round(count / seconds * 60, 3)}
+                       for (window, seconds), count in zip(WINDOWS.items(), counts)},
+    }
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def prometheus_text(metrics: dict) -> str:
+    lines = ["# HELP pose_queue_depth Jobs waiting per priority class, running and dead.",
+             "# TYPE pose_queue_depth gauge"]
+    for state, value in metrics["depth"].items():
+        lines.append(f'pose_queue_depth{{state="{_escape(state)}"}} {value}')
+    lines += ["# HELP pose_actions Non-deleted actions per status.", "# TYPE pose_actions gauge"]
+    for status, value in metrics["status_counts"].items():
+        lines.append(f'pose_actions{{status="{_escape(status)}"}} {value}')
+    for name, help_ in (("wait_seconds", "Time from enqueue to first claim."),
+                        ("run_seconds", "Time from last claim to acknowledgement.")):
+        histogram = metrics[name]
+        lines += [f"# HELP pose_job_{name} {help_}", f"# TYPE pose_job_{name} histogram"]
+        for bound, value in histogram["buckets"].items():
+            lines.append(f'pose_job_{name}_bucket{{le="{bound}"}} {value}')
+        lines += [f"pose_job_{name}_sum {histogram['sum']}", f"pose_job_{name}_count {histogram['count']}"]
+    lines += ["# HELP pose_jobs_finished Jobs acknowledged within the sliding window.",
+              "# TYPE pose_jobs_finished gauge"]
+    for window, values in metrics["throughput"].items():
+        lines.append(f'pose_jobs_finished{{window="{window}"}} {values["finished"]}')
+    return "\n".join(lines) + "\n"
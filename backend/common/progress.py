@@ -0,0 +1,146 @@
+import asyncio
+import json
+import uuid
+from datetime import datetime
+
+from common.cache import LRUCache
+from common.events import publish_action_events
+from common.utils import get_redis_connection
+from config import progress_flush_interval
+from models import Action
+from redis.exceptions import RedisError
+from sqlalchemy import bindparam, or_, update
+
+redis_conn = get_redis_connection()
+
+# action_id -> {"progress", "update_time"}: only the latest value is kept
+PROGRESS_BUFFER = "action_progress:buffer"
+FLUSHING_PREFIX = "action_progress:flushing:"
+# statuses under which a worker still reports progress
+ACTIVE_STATUSES = ("waiting", "running")
+
+# action_id -> patient_id of live actions, so repeated progress reports of a
+# running job skip the existence check
+known_actions = LRUCache(4096)
+
+
+def buffer_progress(session, action_id: int, progress: str) -> bool:
+    """Record a progress report without touching the database.
+
+    Returns False for unknown or deleted actions. Listening clients are told
+    straight away; the row is updated by the next ``flush_progress``.
+    """
+    patient_id = known_actions.get(action_id)
+    if patient_id is None:
+        action = session.query(Action.patient_id).filter(
+            Action.id == action_id, Action.is_deleted == False).first()
+        if not action:
+            return False
+        patient_id = action.patient_id
+        known_actions.set(action_id, patient_id)
+    update_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    redis_conn.hset(PROGRESS_BUFFER, action_id,
+                    json.dumps({"progress": progress, "update_time": update_time}, ensure_ascii=False))
+    publish_action_events([{"action_id": action_id, "patient_id": patient_id,
+                            "progress": progress, "update_time": update_time}])
+    return True
+
+
+def take_buffered_progress(action_id: int) -> dict | None:
+    """Remove and return the pending progress of one action, for callers
+    that are about to write the row themselves."""
+    pipe = redis_conn.pipeline()
+    pipe.hget(PROGRESS_BUFFER, action_id)
+    pipe.hdel(PROGRESS_BUFFER, action_id)
+    value = pipe.execute()[0]
+    return json.loads(value) if value else None
+
+
+def forget_action(action_id: int) -> None:
+    known_actions.set(action_id, None)
+    redis_conn.hdel(PROGRESS_BUFFER, action_id)
+
+
+def merge_buffered_progress(actions: list[dict], id_key: str = "id") -> list[dict]:
+    """Overlay not yet flushed progress onto serialized actions."""
+    if not actions:
+        return actions
+    try:
+        values = redis_conn.hmget(PROGRESS_BUFFER, [action[id_key] for action in actions])
+    except RedisError as e:
+        print(f"Progress buffer unavailable, returning stored progress: {e}")
+        return actions
+    for action, value in zip(actions, values):
+        if value:
+            action.update(json.loads(value))
+    return actions
+
+
+def flush_progress(session) -> int:
+    """Write all buffered progress to the database in one batched UPDATE.
+
+    The buffer is swapped out with an atomic RENAME, so reports arriving
+    during the flush land in a fresh buffer and several processes never
+    write the same snapshot. If the write fails the snapshot is merged back
+    without overwriting newer reports. A row whose status has been written
+    through since the report, or that has ended, keeps what it has.
+    """
+    flushing = f"{FLUSHING_PREFIX}{uuid.uuid4().hex}"
+    try:
+        redis_conn.rename(PROGRESS_BUFFER, flushing)
+    except RedisError:
+        # nothing buffered
+        return 0
+    values = redis_conn.hgetall(flushing)
+    rows = []
+    for action_id, value in values.items():
+        report = json.loads(value)
+        rows.append({"action_id": int(action_id), "progress": report["progress"], "reported": report["update_time"]})
+    table = Action.__table__
+    try:
+        if rows:
+            session.execute(update(table).where(
+                table.c.id == bindparam("action_id"), table.c.is_deleted == False,
+                # IN expands per statement, which executemany cannot do
+                or_(*(table.c.status == status for status in ACTIVE_STATUSES)),
+                table.c.update_time <= bindparam("reported")
+            ).values(progress=bindparam("progress"), update_time=bindparam("reported")), rows)
+        session.commit()
+    except Exception:
+        session.rollback()
+        pipe = redis_conn.pipeline()
+        for action_id, value in values.items():
+            pipe.hsetnx(PROGRESS_BUFFER, action_id, value)
+        pipe.delete(flushing)
+        pipe.execute()
+        raise
+    redis_conn.delete(flushing)
+    return len(rows)
+
+
+def recover_progress() -> None:
+    # snapshots left behind by a process that died while flushing
+    for key in redis_conn.scan_iter(f"{FLUSHING_PREFIX}*"):
+        pipe = redis_conn.pipeline()
+        for action_id, value in redis_conn.hgetall(key).items():
+            pipe.hsetnx(PROGRESS_BUFFER, action_id, value)
+        pipe.delete(key)
+        pipe.execute()
+
+
+async def run_progress_flusher(session_factory) -> None:
+    """Flush the progress buffer every ``progress_flush_interval`` seconds."""
+    def flush():
+        with session_factory() as session:
+            return flush_progress(session)
+
+    try:
+        recover_progress()
+    except RedisError as e:
+        print(f"Failed to recover action progress: {e}")
+    while True:
+        await asyncio.sleep(progress_flush_interval)
+        try:
+            await asyncio.to_thread(flush)
+        except Exception as e:
+            print(f"Failed to flush action progress: {e}")
@@ -0,0 +1,185 @@
+import os
+import uuid
+from email.utils import formatdate, parsedate_to_datetime
+
+import anyio
+from config import stream_block_size, stream_max_range, stream_max_ranges
+from starlette.responses import Response
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def parse_range(header: str, size: int) -> list[tuple[int, int]] | None:
+    """Parse a ``Range`` header into sorted, merged inclusive byte ranges.
+
+    Returns None for headers that are not byte ranges or are malformed, which
+    per RFC 9110 means serving the whole file. Raises RangeNotSatisfiable
+    when no range overlaps the file.
+    """
+    units, _, spec = header.partition("=")
+    if units.strip().lower() != "bytes" or not spec:
+        return None
+    parts = spec.split(",")
+    if len(parts) > stream_max_ranges:
+        return None
+    ranges = []
+    for part in parts:
+        first, dash, last = part.strip().partition("-")
+        if not dash or not (first or last) or not (first or "0").isdigit() or not (last or "0").isdigit():
+            return None
+        if not first:
+            # suffix range: the last N bytes
+            if int(last) == 0:
+                continue
+            start, end = max(size - int(last), 0), size - 1
+        else:
+            start, end = int(first), min(int(last), size - 1) if last else size - 1
+            if last and int(last) < start:
+                return None
+        if start < size:
+            ranges.append((start, end))
+    if not ranges:
+        raise RangeNotSatisfiable()
+    ranges.sort()
+    merged = [ranges[0]]
+    for start, end in ranges[1:]:
+        if start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def _etag(stat) -> str:
+    return f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+
+
+def _not_modified(headers, etag: str, mtime: float) -> bool:
+    if if_none_match := headers.get("if-none-match"):
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return "*" in tags or etag in tags
+    if if_modified_since := headers.get("if-modified-since"):
+        try:
+            return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def _if_range_matches(if_range: str, etag: str, last_modified: str) -> bool:
+    # only strong validators can resume a partial download
+    if if_range.startswith("W/"):
+        return False
+    return if_range == etag or if_range == last_modified
+
+
+class FileRangeResponse(Response):
+    """Serve a file with conditional and range request support.
+
+    Bodies are sent in ``stream_block_size`` blocks read with ``os.pread``
+    in a worker thread, or handed to the server through the ASGI zero-copy
+    send extension (``os.sendfile``) when it offers one, so memory per
+    request stays bounded whatever the range. A single range is capped at
+    ``stream_max_range`` bytes; players simply ask for the next one. A set
+    of ranges adding up to more than that is answered with the whole file.
+    """
+
+    def __init__(self, path: str, request_headers, media_type: str = "video/mp4"):
+        super().__init__(media_type=media_type)
+        self.path = path
+        self.request_headers = request_headers
+        self.ranges = None
+
+    def _prepare(self, stat) -> int:
+        """Set status and headers; returns the body length."""
+        etag, last_modified = _etag(stat), formatdate(stat.st_mtime, usegmt=True)
+        self.headers["etag"] = etag
+        self.headers["last-modified"] = last_modified
+        self.headers["accept-ranges"] = "bytes"
+        if _not_modified(self.request_headers, etag, stat.st_mtime):
+            self.status_code = 304
+            del self.headers["content-type"]
+            del self.headers["content-length"]
+            return 0
+        size = stat.st_size
+        range_header = self.request_headers.get("range")
+        if_range = self.request_headers.get("if-range")
+        if not range_header or (if_range and not _if_range_matches(if_range, etag, last_modified)):
+            self.headers["content-length"] = str(size)
+            return size
+        try:
+            ranges = parse_range(range_header, size)
+        except RangeNotSatisfiable:
+            self.status_code = 416
+            self.headers["content-range"] = f"bytes */{size}"
+            self.headers["content-length"] = "0"
+            return 0
+        if ranges is None:
+            self.headers["content-length"] = str(size)
+            return size
+        if len(ranges) == 1:
+            start, end = ranges[0]
+            ranges = [(start, min(end, start + stream_max_range - 1))]
+        elif sum(end - start + 1 for start, end in ranges) > stream_max_range:
+            # parts of a multipart body cannot be cut short without the client
+            # taking them for complete; ignoring the header is always allowed
+            self.headers["content-length"] = str(size)
+            return size
+        self.status_code = 206
+        self.ranges = ranges
+        if len(self.ranges) == 1:
+            start, end = self.ranges[0]
+            self.headers["content-range"] = f"bytes {start}-{end}/{size}"
+            self.headers["content-length"] = str(end - start + 1)
+            return end - start + 1
+        boundary = uuid.uuid4().hex
+        part_type = self.media_type
+        self.parts = [(f"--{boundary}\r\nContent-Type: {part_type}\r\n"
+                       f"Content-Range: bytes {start}-{end}/{size}\r\n\r\n").encode()
+                      for start, end in self.ranges]
+        self.closing = f"\r\n--{boundary}--\r\n".encode()
+        self.headers["content-type"] = f"multipart/byteranges; boundary={boundary}"
+        length = sum(len(part) + end - start + 1 for part, (start, end) in zip(self.parts, self.ranges))
+        length += 2 * (len(self.ranges) - 1) + len(self.closing)
+        self.headers["content-length"] = str(length)
+        return length
+
+    async def __call__(self, scope, receive, send) -> None:
+        try:
+            file = open(self.path, "rb")
+        except OSError:
+            await Response("Video file not found on server.", status_code=404)(scope, receive, send)
+            return
+        with file:
+            length = self._prepare(os.fstat(file.fileno()))
+            await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+            if scope["method"] == "HEAD" or length == 0:
+                await send({"type": "http.response.body", "body": b""})
+                return
+            zerocopy = "http.response.zerocopysend" in scope.get("extensions", {})
+            if self.status_code == 200:
+                await self._send_range(send, file, 0, length - 1, zerocopy, more_body=False)
+            elif len(self.ranges) == 1:
+                start, end = self.ranges[0]
+                await self._send_range(send, file, start, end, zerocopy, more_body=False)
+            else:
+                for i, ((start, end), part) in enumerate(zip(self.ranges, self.parts)):
+                    await send({"type": "http.response.body", "body": (b"\r\n" if i else b"") + part, "more_body": True})
+                    await self._send_range(send, file, start, end, zerocopy, more_body=True)
+                await send({"type": "http.response.body", "body": self.closing})
+
+    async def _send_range(self, send, file, start: int, end: int, zerocopy: bool, more_body: bool) -> None:
+        if zerocopy:
+            await send({"type": "http.response.zerocopysend", "file": file, "offset": start,
+                        "count": end - start + 1, "more_body": more_body})
+            return
+        position = start
+        while position <= end:
+            block = await anyio.to_thread.run_sync(os.pread, file.fileno(), min(stream_block_size, end - position + 1), position)
+            if not block:
+                # the file shrank under us; the declared length can no longer be met
+                raise OSError(f"Unexpected end of file in {self.path}")
+            position += len(block)
+            await send({"type": "http.response.body", "body": block, "more_body": more_body or position <= end})
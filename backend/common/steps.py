@@ -0,0 +1,73 @@
+import numpy as np
+from models import Stage, StepsInfo
+
+STEP_COLUMNS = ("stage_id", "step_id", "start_frame", "end_frame", "step_length",
+                "step_speed", "front_leg", "support_time", "liftoff_height",
+                "hip_min_degree", "hip_max_degree", "first_step", "steps_diff",
+                "stride_length", "step_width")
+
+_TEXT_COLUMNS = ("front_leg",)
+_BOOL_COLUMNS = ("first_step",)
+_INT_COLUMNS = ("stage_id", "step_id", "start_frame", "end_frame")
+
+
+def _to_array(column: str, values) -> np.ndarray:
+    if column in _TEXT_COLUMNS:
+        return np.asarray(values, dtype=object)
+    if column in _BOOL_COLUMNS:
+        return np.asarray([bool(v) for v in values], dtype=bool)
+    if column in _INT_COLUMNS:
+        return np.asarray(values, dtype=np.int64)
+    # None becomes NaN so missing measurements can be masked out later
+    return np.asarray(values, dtype=np.float64)
+
+
+def _columnar(columns: tuple, rows) -> dict[str, np.ndarray]:
+    values = list(zip(*rows)) if rows else [()] * len(columns)
+    steps = {column: _to_array(column, value)
+             for column, value in zip(columns, values)}
+    steps["step_no"] = np.arange(1, len(rows) + 1)
+    return steps
+
+
+def columnar_steps(rows: list[dict], columns=STEP_COLUMNS) -> dict[str, np.ndarray]:
+    """Columnar arrays, as ``load_action_steps`` returns, from step dicts not read back."""
+    columns = tuple(columns)
+    return _columnar(columns, [tuple(row[column] for column in columns) for row in rows])
+
+
+def _steps_query(session, columns: list):
+    return session.query(*columns).join(
+        Stage, Stage.id == StepsInfo.stage_id
+    ).filter(
+        Stage.is_deleted == False,
+        StepsInfo.is_deleted == False
+    )
+
+
+def load_action_steps(session, action_id: int, columns=STEP_COLUMNS) -> dict[str, np.ndarray]:
+    """Fetch the non-deleted steps of an action as columnar arrays.
+
+    One joined query replaces the stage-by-stage scan; only the requested
+    columns are selected. ``step_no`` (1-based position in the session) is
+    always included so charts can keep their labels after slicing.
+    """
+    columns = tuple(columns)
+    rows = _steps_query(session, [getattr(StepsInfo, column) for column in columns]).filter(
+        Stage.action_id == action_id
+    ).order_by(Stage.stage_n, Stage.id, StepsInfo.step_id, StepsInfo.id).all()
+    return _columnar(columns, rows)
+
+
+def load_actions_steps(session, action_ids, columns=STEP_COLUMNS) -> dict[int, dict[str, np.ndarray]]:
+    """Same as ``load_action_steps`` for several actions with one ``IN`` query."""
+    columns = tuple(columns)
+    action_ids = list(dict.fromkeys(action_ids))
+    rows = _steps_query(session, [Stage.action_id] + [getattr(StepsInfo, column) for column in columns]).filter(
+        Stage.action_id.in_(action_ids)
+    ).order_by(Stage.action_id, Stage.stage_n, Stage.id, StepsInfo.step_id, StepsInfo.id).all()
+
+    grouped = {action_id: [] for action_id in action_ids}
+    for row in rows:
+        grouped[row[0]].append(row[1:])
+    return {action_id: _columnar(columns, action_rows) for action_id, action_rows in grouped.items()}
@@ -0,0 +1,254 @@
+from datetime import datetime
+
+import numpy as np
+from common.cache import mark_actions_changed
+from common.steps import load_action_steps, load_actions_steps
+from sqlalchemy import update
+from sqlalchemy.dialects.postgresql import insert
+from models import Action, ActionMetricSummary, PatientMetricTrend, Stage
+
+# metric name -> step columns it summarizes; several columns are pooled
+METRIC_COLUMNS = {
+    "step_hip_degree": ("hip_min_degree", "hip_max_degree"),
+    "step_length": ("step_length",),
+    "step_width": ("step_width",),
+    "step_speed": ("step_speed",),
+    "step_stride": ("stride_length",),
+    "step_difference": ("steps_diff",),
+    "support_time": ("support_time",),
+    "liftoff_height": ("liftoff_height",),
+}
+
+# stride and step difference are undefined for the first step of a stage
+SKIP_FIRST_STEP = ("stride_length", "steps_diff")
+
+# per-column breakdowns reported next to the pooled value, keyed by prefix
+COLUMN_VARIANTS = {
+    "step_hip_degree": {"low_": "hip_min_degree", "high_": "hip_max_degree"},
+}
+
+VALUE_COLUMNS = tuple(dict.fromkeys(
+    column for columns in METRIC_COLUMNS.values() for column in columns))
+SUMMARY_COLUMNS = ("front_leg", "first_step") + VALUE_COLUMNS
+
+SIDES = {"": None, "left_": "left", "right_": "right"}
+
+# per-metric statistics kept in the longitudinal patient rollup
+TREND_STATS = ("average", "standard_deviation", "min_value", "max_value",
+               "left_average", "right_average")
+
+
+def _group_stats(matrix: np.ndarray, rows: np.ndarray):
+    # count, mean, sum of squared deviations, min and max for every column,
+    # ignoring NaN cells
+    data = matrix[rows]
+    present = ~np.isnan(data)
+    count = present.sum(axis=0)
+    total = np.where(present, data, 0.0).sum(axis=0)
+    mean = np.divide(total, count, out=np.zeros_like(total), where=count > 0)
+    m2 = (np.where(present, data - mean, 0.0) ** 2).sum(axis=0)
+    low = np.where(present, data, np.inf).min(axis=0, initial=np.inf)
+    high = np.where(present, data, -np.inf).max(axis=0, initial=-np.inf)
+    return count, mean, m2, low, high
+
+
+def _pool(stats, indexes):
+    # Chan's parallel update: merge per-column moments without another pass
+    count, mean, m2, low, high = (values[list(indexes)] for values in stats)
+    n = count.sum()
+    if n == 0:
+        return 0, 0.0, 0.0, np.inf, -np.inf
+    pooled_mean = (count * mean).sum() / n
+    pooled_m2 = (m2 + count * (mean - pooled_mean) ** 2).sum()
+    return n, pooled_mean, pooled_m2, low.min(), high.max()
+
+
+def _format(prefix: str, count, mean, m2, low, high) -> dict:
+    if count == 0:
+        return {f"{prefix}average": 0.0, f"{prefix}standard_deviation": 0.0,
+                f"{prefix}min_value": 0, f"{prefix}max_value": 0}
+    std = float(np.sqrt(m2 / (count - 1))) if count > 1 else 0.0
+    return {
+        f"{prefix}average": round(float(mean), 2),
+        f"{prefix}standard_deviation": round(std, 2),
+        f"{prefix}min_value": float(low),
+        f"{prefix}max_value": float(high),
+    }
+
+
+def step_moments(steps: dict[str, np.ndarray]) -> dict[str, tuple]:
+    """Per-column count, mean, sum of squared deviations, min and max of the
+    steps, for each side. Moments of separate batches combine with
+    ``merge_moments``."""
+    matrix = np.column_stack([steps[column] for column in VALUE_COLUMNS]) \
+        if len(steps["front_leg"]) else np.empty((0, len(VALUE_COLUMNS)))
+    for column in SKIP_FIRST_STEP:
+        matrix[steps["first_step"], VALUE_COLUMNS.index(column)] = np.nan
+    return {side: _group_stats(matrix, np.ones(len(matrix), dtype=bool) if leg is None
+                               else steps["front_leg"] == leg)
+            for side, leg in SIDES.items()}
+
+
+def _merge(a, b):
+    count_a, mean_a, m2_a, low_a, high_a = a
+    count_b, mean_b, m2_b, low_b, high_b = b
+    count = count_a + count_b
+    mean = np.divide(count_a * mean_a + count_b * mean_b, count,
+                     out=np.zeros_like(mean_a), where=count > 0)
+    m2 = m2_a + m2_b + (mean_b - mean_a) ** 2 * np.divide(
+        count_a * count_b, count, out=np.zeros_like(mean_a), where=count > 0)
+    return count, mean, m2, np.minimum(low_a, low_b), np.maximum(high_a, high_b)
+
+
+def merge_moments(a: dict[str, tuple], b: dict[str, tuple]) -> dict[str, tuple]:
+    # Chan's parallel update, column by column
+    return {side: _merge(a[side], b[side]) for side in SIDES}
+
+
+def summarize_moments(moments: dict[str, tuple]) -> dict[str, dict]:
+    summary = {metric: {} for metric in METRIC_COLUMNS}
+    for side, stats in moments.items():
+        for metric, columns in METRIC_COLUMNS.items():
+            indexes = [VALUE_COLUMNS.index(column) for column in columns]
+            summary[metric].update(_format(side, *_pool(stats, indexes)))
+            for variant, column in COLUMN_VARIANTS.get(metric, {}).items():
+                summary[metric].update(_format(
+                    f"{side}{variant}", *_pool(stats, [VALUE_COLUMNS.index(column)])))
+    return summary
+
+
+def summarize_steps(steps: dict[str, np.ndarray]) -> dict[str, dict]:
+    """Left, right and overall mean, sample std, min and max of every metric.
+
+    ``steps`` is the columnar output of ``load_action_steps`` with at least
+    ``SUMMARY_COLUMNS``. All metrics are computed together on one matrix.
+    """
+    return summarize_moments(step_moments(steps))
+
+
+def load_action_summary(session, action_id: int) -> dict[str, dict]:
+    return summarize_steps(load_action_steps(session, action_id, SUMMARY_COLUMNS))
+
+
+def _store_summary(session, action_id: int, steps: dict[str, np.ndarray]) -> dict[str, dict]:
+    summary = summarize_steps(steps)
+    _save_summary(session, action_id, summary, len(steps["step_no"]))
+    return summary
+
+
+def _upsert(session, model, values: dict, updates: tuple) -> None:
+    # INSERT ... ON CONFLICT: concurrent first reads and a writer may all
+    # store the same action; the last one wins instead of failing
+    statement = insert(model).values(**values)
+    session.execute(statement.on_conflict_do_update(
+        index_elements=[model.action_id], set_={column: statement.excluded[column] for column in updates}))
+
+
+def _save_summary(session, action_id: int, summary: dict[str, dict], step_count: int) -> None:
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    _upsert(session, ActionMetricSummary, {"action_id": action_id, "step_count": step_count, "summary": summary,
+                                           "create_time": now, "update_time": now},
+            ("step_count", "summary", "update_time"))
+    _store_trend(session, action_id, summary, step_count, now)
+
+
+def _store_trend(session, action_id: int, summary: dict[str, dict], step_count: int, now: str) -> None:
+    action = session.query(Action.patient_id, Action.create_time).filter(
+        Action.id == action_id).first()
+    if not action:
+        return
+    metrics = {metric: {stat: stats[stat] for stat in TREND_STATS}
+               for metric, stats in summary.items()}
+    _upsert(session, PatientMetricTrend, {"action_id": action_id, "patient_id": action.patient_id,
+                                          "action_time": action.create_time, "step_count": step_count,
+                                          "metrics": metrics, "create_time": now, "update_time": now},
+            ("step_count", "metrics", "update_time"))
+
+
+def _touch_actions(session, action_ids) -> None:
+    # the action's update_time is part of its ETag (common.etag)
+    session.execute(update(Action).where(Action.id.in_(action_ids)).values(
+        update_time=datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+
+
+def refresh_action_summary(session, action_id: int) -> dict[str, dict]:
+    """Recompute the stored summary of an action and invalidate its cached
+    charts once the caller commits."""
+    session.flush()
+    mark_actions_changed(session, [action_id])
+    _touch_actions(session, [action_id])
+    return _store_summary(session, action_id, load_action_steps(session, action_id, SUMMARY_COLUMNS))
+
+
+def store_action_moments(session, action_id: int, moments: dict[str, tuple], step_count: int) -> dict[str, dict]:
+    """Store the summary of already merged step moments, without reading the
+    steps back, and invalidate the cached charts once the caller commits."""
+    mark_actions_changed(session, [action_id])
+    _touch_actions(session, [action_id])
+    summary = summarize_moments(moments)
+    _save_summary(session, action_id, summary, step_count)
+    return summary
+
+
+def clear_action_summaries(session, action_ids) -> None:
+    """Drop stored summaries and trend rows of deleted actions and invalidate
+    their cached charts once the caller commits."""
+    action_ids = list(action_ids)
+    mark_actions_changed(session, action_ids)
+    if action_ids:
+        _touch_actions(session, action_ids)
+        session.query(ActionMetricSummary).filter(
+            ActionMetricSummary.action_id.in_(action_ids)).delete(synchronize_session=False)
+        session.query(PatientMetricTrend).filter(
+            PatientMetricTrend.action_id.in_(action_ids)).delete(synchronize_session=False)
+
+
+def get_action_summary(session, action_id: int) -> dict[str, dict]:
+    row = session.get(ActionMetricSummary, action_id)
+    if row:
+        return row.summary
+    steps = load_action_steps(session, action_id, SUMMARY_COLUMNS)
+    if not len(steps["step_no"]):
+        return summarize_steps(steps)
+    # Results ingested before summaries were stored are backfilled on first read
+    summary = _store_summary(session, action_id, steps)
+    session.commit()
+    return summary
+
+
+def _backfill_trends(session, patient_id: int) -> None:
+    # actions analysed before trend rows were stored have steps but no row yet
+    missing = [action_id for action_id, in session.query(Action.id).filter(
+        Action.patient_id == patient_id,
+        Action.is_deleted == False,
+        ~session.query(PatientMetricTrend).filter(
+            PatientMetricTrend.action_id == Action.id).exists(),
+        session.query(Stage).filter(Stage.action_id == Action.id,
+                                    Stage.is_deleted == False).exists(),
+    ).all()]
+    if not missing:
+        return
+    stored = False
+    for action_id, steps in load_actions_steps(session, missing, SUMMARY_COLUMNS).items():
+        if len(steps["step_no"]):
+            _store_summary(session, action_id, steps)
+            stored = True
+    if stored:
+        session.commit()
+
+
+def load_patient_trends(session, patient_id: int) -> dict:
+    """Time-ordered per-metric series over all analysed actions of a patient."""
+    _backfill_trends(session, patient_id)
+    rows = session.query(PatientMetricTrend).filter(
+        PatientMetricTrend.patient_id == patient_id
+    ).order_by(PatientMetricTrend.action_time, PatientMetricTrend.action_id).all()
+    return {
+        "patient_id": patient_id,
+        "action_ids": [row.action_id for row in rows],
+        "times": [row.action_time for row in rows],
+        "step_counts": [row.step_count for row in rows],
+        "metrics": {metric: {stat: [row.metrics.get(metric, {}).get(stat) for row in rows]
+                             for stat in TREND_STATS}
+                    for metric in METRIC_COLUMNS},
+    }
@@ -0,0 +1,206 @@
+import glob
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+
+from common.content_store import checkout, store
+from common.events import mark_action_event
+from common.job_queue import drop_deferred, release_deferred
+from common.utils import convert_to_mp4, get_redis_connection
+from config import transcode_lock_ttl, transcode_slots
+from models import Action, VideoPath, engine
+from sqlmodel import Session
+
+redis_conn = get_redis_connection()
+
+# held while a process owns a video's conversion, so only one process runs it
+LOCK_PREFIX = "transcode:lock:"
+
+# Running conversions of all processes: slot token -> lease expiry. An entry
+# is renewed while its ffmpeg runs, so a crashed process frees its slot.
+SLOTS_KEY = "transcode:slots"
+SLOT_LEASE = 60
+SLOT_POLL = 1
+
+_take_slot = redis_conn.register_script("""
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])
+if redis.call('ZCARD', KEYS[1]) < tonumber(ARGV[2]) then
+  redis.call('ZADD', KEYS[1], ARGV[3], ARGV[4])
+  return 1
+end
+return 0
+""")
+
+# One thread per slot is all a process can ever use; conversions beyond
+# that queue here, and threads wait for a slot free in every process.
+pool = ThreadPoolExecutor(max_workers=transcode_slots, thread_name_prefix="transcode")
+futures = {}
+stopping = threading.Event()
+
+
+def source_path(video_path: str, ext: str) -> str:
+    # the upload as received, kept next to its target until converted
+    return f"{os.path.splitext(video_path)[0]}.source{ext}"
+
+
+def submit(video_id: int, source: str, target: str) -> bool:
+    if not redis_conn.set(f"{LOCK_PREFIX}{video_id}", os.getpid(), nx=True, ex=transcode_lock_ttl):
+        return False
+    futures[video_id] = pool.submit(_transcode, video_id, source, target)
+    return True
+
+
+def _renew_slot(token: str, done: threading.Event) -> None:
+    while not done.wait(SLOT_LEASE / 3):
+        try:
+            redis_conn.zadd(SLOTS_KEY, {token: time.time() + SLOT_LEASE}, xx=True)
+        except Exception as e:
+            print(f"Failed to renew transcode slot {token}: {e}")
+
+
+@contextmanager
+def _slot():
+    """Hold one of the ``transcode_slots`` shared by every process; yields
+    False if the process stops before one is free."""
+    token = uuid.uuid4().hex
+    while not _take_slot(keys=[SLOTS_KEY], args=[time.time(), transcode_slots, time.time() + SLOT_LEASE, token]):
+        if stopping.wait(SLOT_POLL):
+            yield False
+            return
+    done = threading.Event()
+    threading.Thread(target=_renew_slot, args=(token, done), daemon=True).start()
+    try:
+        yield True
+    finally:
+        done.set()
+        redis_conn.zrem(SLOTS_KEY, token)
+
+
+def _convert(source: str, target: str) -> bool | None:
+    with _slot() as taken:
+        return convert_to_mp4(source, target) if taken else None
+
+
+def _transcode(video_id: int, source: str, target: str) -> None:
+    try:
+        ok = _convert(source, target)
+    except Exception as e:
+        print(f"Conversion of video {video_id} crashed: {e}")
+        ok = False
+    try:
+        if ok is None:
+            # stopped while waiting for a slot; the source is kept for the next start
+            return
+        if not ok and os.path.exists(target):
+            os.remove(target)
+        _finish(video_id, "ready" if ok else "failed")
+        # removed last: duplicates treat an upload with a source as still converting
+        os.remove(source)
+    except Exception as e:
+        print(f"Failed to record the conversion of video {video_id}: {e}")
+    finally:
+        redis_conn.delete(f"{LOCK_PREFIX}{video_id}")
+        futures.pop(video_id, None)
+
+
+def _waiting_duplicates(session, video: VideoPath) -> list[VideoPath]:
+    # identical uploads that arrived while this one was converting
+    if not video.content_hash:
+        return []
+    return session.query(VideoPath).filter(VideoPath.content_hash == video.content_hash,
+                                           VideoPath.status == "transcoding", VideoPath.id != video.id).all()
+
+
+def _finish(video_id: int, status: str) -> None:
+    with Session(engine) as session:
+        video = session.get(VideoPath, video_id)
+        if video is None:
+            return
+        videos = [video] + _waiting_duplicates(session, video)
+        if status == "ready" and video.content_hash:
+            store(video.video_path, video.content_hash)
+            for duplicate in videos[1:]:
+                checkout(video.content_hash, duplicate.video_path)
+        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        for video in videos:
+            video.status = status
+            video.update_time = now
+        session.commit()
+        video_ids = [video.id for video in videos]
+    for video_id in video_ids:
+        settle(video_id)
+
+
+def _has_source(video: VideoPath) -> bool:
+    return bool(glob.glob(f"{glob.escape(source_path(video.video_path, ''))}*"))
+
+
+def attach(video_id: int) -> None:
+    """Finish a duplicate upload registered while the conversion of the
+    same content was running, in case that conversion has already ended."""
+    with Session(engine) as session:
+        video = session.get(VideoPath, video_id)
+        if video is None or video.status != "transcoding":
+            return
+        if video.content_hash and checkout(video.content_hash, video.video_path):
+            video.status = "ready"
+        elif not any(_has_source(duplicate) for duplicate in _waiting_duplicates(session, video)):
+            # nothing left that converts this content
+            video.status = "failed"
+        else:
+            return
+        video.update_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        session.commit()
+    settle(video_id)
+
+
+def settle(video_id: int) -> None:
+    """Schedule, or fail, the jobs held back for a video whose conversion
+    has ended. Safe to call more than once."""
+    with Session(engine) as session:
+        video = session.get(VideoPath, video_id)
+        if video is None or video.status == "transcoding":
+            return
+        if video.status == "ready":
+            release_deferred(video_id)
+            return
+        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        for action in session.query(Action).filter(Action.video_id == video_id, Action.status == "waiting",
+                                                    Action.is_deleted == False).all():
+            action.status = "failed"
+            action.progress = "video conversion failed"
+            action.update_time = now
+            mark_action_event(session, action)
+        session.commit()
+    drop_deferred(video_id)
+
+
+def resume_transcoding() -> int:
+    """Resubmit conversions interrupted by a restart; videos whose upload is
+    gone are marked failed."""
+    with Session(engine) as session:
+        videos = session.query(VideoPath.id, VideoPath.video_path).filter(
+            VideoPath.status == "transcoding", VideoPath.is_deleted == False).all()
+    resumed = 0
+    for video_id, video_path in videos:
+        if redis_conn.exists(f"{LOCK_PREFIX}{video_id}"):
+            continue
+        if sources := glob.glob(f"{glob.escape(source_path(video_path, ''))}*"):
+            resumed += submit(video_id, sources[0], video_path)
+        else:
+            # duplicates have no upload of their own and follow their original
+            attach(video_id)
+    return resumed
+
+
+def shutdown() -> None:
+    stopping.set()
+    pool.shutdown(wait=False, cancel_futures=True)
+    # conversions that never started are picked up again on the next start
+    for video_id, future in list(futures.items()):
+        if future.cancelled():
+            redis_conn.delete(f"{LOCK_PREFIX}{video_id}")
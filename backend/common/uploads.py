@@ -0,0 +1,208 @@
+import hashlib
+import os
+import time
+import uuid
+
+import anyio
+from common.utils import get_redis_connection
+from config import upload_staging_ttl
+
+redis_conn = get_redis_connection()
+
+# staging files live in the destination directory, so committing is a rename
+STAGING_PREFIX = ".upload-"
+
+# Resumable uploads: upload_id -> patient_id, filename, size, path. The bytes
+# received so far are the staging file itself, so its size is the offset.
+UPLOAD_PREFIX = "video_upload:"
+UPLOAD_LOCK_PREFIX = "video_upload:lock:"
+UPLOAD_LOCK_TTL = 60
+# request body chunks are gathered up to this size before each disk write
+UPLOAD_WRITE_SIZE = 1024 * 1024
+
+
+class UploadWriter:
+    """Stream an upload into a staging file next to its destination.
+
+    Writes and hashing run in a worker thread so the event loop keeps serving
+    other requests while a large recording comes in. The SHA-256 and size
+    are computed from the same chunks, and ``commit`` moves the file into
+    place with an atomic rename on the same filesystem, so every byte is
+    written once and a half-written file is never visible under its name.
+    """
+
+    def __init__(self, directory: str, suffix: str = ""):
+        self.path = os.path.join(directory, f"{STAGING_PREFIX}{uuid.uuid4().hex}{suffix}")
+        self.file = open(self.path, "xb")
+        self.size = 0
+        self._hash = hashlib.sha256()
+
+    @property
+    def sha256(self) -> str:
+        return self._hash.hexdigest()
+
+    def _write(self, chunk: bytes) -> None:
+        self.file.write(chunk)
+        self._hash.update(chunk)
+
+    async def write(self, chunk: bytes) -> None:
+        await anyio.to_thread.run_sync(self._write, chunk)
+        self.size += len(chunk)
+
+    def _commit(self, destination: str) -> None:
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+        os.replace(self.path, destination)
+
+    async def commit(self, destination: str) -> None:
+        await anyio.to_thread.run_sync(self._commit, destination)
+
+    def abort(self) -> None:
+        self.file.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def clean_stale_uploads(directory: str, max_age: float) -> int:
+    """Remove staging files abandoned by a crashed process."""
+    removed = 0
+    cutoff = time.time() - max_age
+    for entry in os.scandir(directory):
+        if entry.name.startswith(STAGING_PREFIX) and entry.stat().st_mtime < cutoff:
+            os.remove(entry.path)
+            removed += 1
+    return removed
+
+
+class UploadOverflow(Exception):
+    pass
+
+
+def hash_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while block := f.read(UPLOAD_WRITE_SIZE):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def create_upload(directory: str, patient_id: int, filename: str, size: int) -> str:
+    upload_id = uuid.uuid4().hex
+    path = os.path.join(directory, f"{STAGING_PREFIX}{upload_id}{os.path.splitext(filename)[1].lower()}")
+    open(path, "xb").close()
+    pipe = redis_conn.pipeline()
+    pipe.hset(f"{UPLOAD_PREFIX}{upload_id}", mapping={
+        "patient_id": patient_id, "filename": filename, "size": size, "path": path})
+    pipe.expire(f"{UPLOAD_PREFIX}{upload_id}", upload_staging_ttl)
+    pipe.execute()
+    return upload_id
+
+
+def get_upload(upload_id: str) -> dict | None:
+    values = redis_conn.hgetall(f"{UPLOAD_PREFIX}{upload_id}")
+    if not values:
+        return None
+    upload = {k.decode(): v.decode() for k, v in values.items()}
+    try:
+        upload["offset"] = os.path.getsize(upload["path"])
+    except OSError:
+        return None
+    upload.update(upload_id=upload_id, patient_id=int(upload["patient_id"]), size=int(upload["size"]))
+    return upload
+
+
+class UploadLockLost(Exception):
+    pass
+
+
+# the lock holds its owner's token; only that owner may extend or drop it
+_refresh_lock = redis_conn.register_script("""
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+  return redis.call('EXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+""")
+
+_unlock = redis_conn.register_script("""
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+  return redis.call('DEL', KEYS[1])
+end
+return 0
+""")
+
+
+def lock_upload(upload_id: str) -> str | None:
+    """Take the single-writer lock of an upload; returns the owner token, or
+    None if another request holds it. The lock expires if its process dies
+    mid-request."""
+    token = uuid.uuid4().hex
+    if redis_conn.set(f"{UPLOAD_LOCK_PREFIX}{upload_id}", token, nx=True, ex=UPLOAD_LOCK_TTL):
+        return token
+    return None
+
+
+def refresh_upload_lock(upload_id: str, token: str) -> bool:
+    return bool(_refresh_lock(keys=[f"{UPLOAD_LOCK_PREFIX}{upload_id}"], args=[token, UPLOAD_LOCK_TTL]))
+
+
+def unlock_upload(upload_id: str, token: str) -> None:
+    _unlock(keys=[f"{UPLOAD_LOCK_PREFIX}{upload_id}"], args=[token])
+
+
+async def append_upload(upload: dict, chunks, token: str) -> int:
+    """Append a request body to a resumable upload at its current offset.
+
+    At most ``UPLOAD_WRITE_SIZE`` bytes are held in memory. What was written
+    before the client goes away is kept, so the next request resumes after
+    it. The lock held with ``token`` is renewed while the body comes in,
+    however slowly; if it has expired and may have passed to another
+    request, nothing more is written and UploadLockLost is raised. Raises
+    UploadOverflow when the body runs past the declared size, leaving the
+    file as it was before the request. Returns the new offset.
+    """
+    upload_id, offset, size = upload["upload_id"], upload["offset"], upload["size"]
+    buffer = bytearray()
+    refreshed = time.monotonic()
+
+    def hold():
+        nonlocal refreshed
+        if time.monotonic() - refreshed > UPLOAD_LOCK_TTL / 3:
+            if not refresh_upload_lock(upload_id, token):
+                buffer.clear()
+                raise UploadLockLost()
+            refreshed = time.monotonic()
+
+    def write(f, data):
+        f.write(data)
+        f.flush()
+
+    with open(upload["path"], "r+b") as f:
+        f.seek(offset)
+        try:
+            async for chunk in chunks:
+                hold()
+                if offset + len(buffer) + len(chunk) > size:
+                    # refuse the request whole: drop what it already wrote
+                    buffer.clear()
+                    await anyio.to_thread.run_sync(f.truncate, upload["offset"])
+                    raise UploadOverflow()
+                buffer += chunk
+                if len(buffer) >= UPLOAD_WRITE_SIZE:
+                    await anyio.to_thread.run_sync(write, f, bytes(buffer))
+                    offset += len(buffer)
+                    buffer.clear()
+            if buffer:
+                hold()
+                await anyio.to_thread.run_sync(write, f, bytes(buffer))
+                offset += len(buffer)
+        finally:
+            await anyio.to_thread.run_sync(os.fsync, f.fileno())
+    redis_conn.expire(f"{UPLOAD_PREFIX}{upload_id}", upload_staging_ttl)
+    return offset
+
+
+def delete_upload(upload: dict, remove_file: bool = True) -> None:
+    redis_conn.delete(f"{UPLOAD_PREFIX}{upload['upload_id']}")
+    if remove_file and os.path.exists(upload["path"]):
+        os.remove(upload["path"])
@@ -21,7 +21,7 @@ def check_password(password: str, hashed_password: str) -> bool:
 
 
 def get_length_to_show():
-    return os.getenv("LENGTH_TO_SHOW", length_to_show)
+    return int(os.getenv("LENGTH_TO_SHOW", length_to_show))
 
 
 def calculate_stats(data: list[float | int | None]) -> tuple[float, float]:
@@ -19,3 +19,40 @@ redis_db = 0
 
 # Dashboard
 length_to_show = 20
+
+# Chart cache
+chart_cache_size = int(os.getenv("CHART_CACHE_SIZE", 512))
+chart_cache_ttl = int(os.getenv("CHART_CACHE_TTL", 24 * 60 * 60))
+
+# Streaming result ingest
+ingest_batch_size = int(os.getenv("INGEST_BATCH_SIZE", 500))
+ingest_max_line = 1024 * 1024
+
+# Action job queue
+job_visibility_timeout = int(os.getenv("JOB_VISIBILITY_TIMEOUT", 30 * 60))
+job_max_deliveries = int(os.getenv("JOB_MAX_DELIVERIES", 3))
+# "doctor" or "department": who gets a fair share of the workers
+scheduler_share_by = os.getenv("SCHEDULER_SHARE_BY", "doctor")
+
+# Seconds between keepalive comments on the action event stream
+sse_keepalive = 15
+
+# Seconds between batched writes of buffered action progress
+progress_flush_interval = float(os.getenv("PROGRESS_FLUSH_INTERVAL", 2))
+
+# Seconds a batch submission's idempotency key is remembered
+idempotency_ttl = 24 * 60 * 60
+
+# Video streaming: read block size, largest single range served, most ranges per request
+stream_block_size = 64 * 1024
+stream_max_range = int(os.getenv("STREAM_MAX_RANGE", 8 * 1024 * 1024))
+stream_max_ranges = 16
+
+# Background transcoding of non-MP4 uploads
+# conversions running at once over all processes sharing the Redis
+transcode_slots = int(os.getenv("TRANSCODE_SLOTS", 2))
+# how long one video may stay claimed by a process, queued and converting
+transcode_lock_ttl = 6 * 60 * 60
+
+# Seconds before an unfinished upload staging file is considered abandoned
+upload_staging_ttl = 24 * 60 * 60
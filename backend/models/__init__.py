@@ -1,12 +1,15 @@
 from config import postgres_uri
 from fastapi import Depends
 from models.action import Action
+from models.action_metric_summary import ActionMetricSummary
 from models.roles import Roles
 from models.stage import Stage
 from models.steps_info import StepsInfo
 from models.patients import Patients
+from models.patient_metric_trend import PatientMetricTrend
 from models.doctors import Doctors
 from models.video_path import VideoPath
+from sqlalchemy import text
 from sqlmodel import Session, SQLModel, create_engine
 from typing_extensions import Annotated
 
@@ -16,6 +19,11 @@ print("engine", engine)
 
 def create_db_and_tables():
     SQLModel.metadata.create_all(engine)
+    # create_all only creates missing tables, not columns added since
+    with engine.begin() as conn:
+        conn.execute(text("ALTER TABLE videopath ADD COLUMN IF NOT EXISTS status VARCHAR NOT NULL DEFAULT 'ready'"))
+        conn.execute(text("ALTER TABLE videopath ADD COLUMN IF NOT EXISTS content_hash VARCHAR"))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_videopath_content_hash ON videopath (content_hash)"))
 
 
 def get_session():
@@ -0,0 +1,28 @@
+from datetime import datetime
+
+from sqlalchemy import JSON, Column
+from sqlmodel import Field, SQLModel
+
+
+class ActionMetricSummary(SQLModel, table=True):
+    action_id: int = Field(primary_key=True, sa_column_kwargs={"autoincrement": False})
+    step_count: int
+    summary: dict = Field(default_factory=dict, sa_column=Column(JSON))
+    create_time: str = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    update_time: str = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+    def __init__(self, action_id: int, step_count: int, summary: dict, create_time: str, update_time: str):
+        self.action_id = action_id
+        self.step_count = step_count
+        self.summary = summary
+        self.create_time = create_time
+        self.update_time = update_time
+
+    def to_dict(self):
+        return {
+            "action_id": self.action_id,
+            "step_count": self.step_count,
+            "summary": self.summary,
+            "create_time": self.create_time,
+            "update_time": self.update_time
+        }
@@ -0,0 +1,34 @@
+from datetime import datetime
+
+from sqlalchemy import JSON, Column
+from sqlmodel import Field, SQLModel
+
+
+class PatientMetricTrend(SQLModel, table=True):
+    action_id: int = Field(primary_key=True, sa_column_kwargs={"autoincrement": False})
+    patient_id: int = Field(index=True)
+    action_time: str
+    step_count: int
+    metrics: dict = Field(default_factory=dict, sa_column=Column(JSON))
+    create_time: str = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    update_time: str = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+    def __init__(self, action_id: int, patient_id: int, action_time: str, step_count: int, metrics: dict, create_time: str, update_time: str):
+        self.action_id = action_id
+        self.patient_id = patient_id
+        self.action_time = action_time
+        self.step_count = step_count
+        self.metrics = metrics
+        self.create_time = create_time
+        self.update_time = update_time
+
+    def to_dict(self):
+        return {
+            "action_id": self.action_id,
+            "patient_id": self.patient_id,
+            "action_time": self.action_time,
+            "step_count": self.step_count,
+            "metrics": self.metrics,
+            "create_time": self.create_time,
+            "update_time": self.update_time
+        }
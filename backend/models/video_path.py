@@ -14,8 +14,12 @@ class VideoPath(SQLModel, table=True):
     create_time: str = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     update_time: str = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     is_deleted: bool
+    # "transcoding" until a non-MP4 upload has been converted, then "ready" or "failed"
+    status: str = Field(default="ready", sa_column_kwargs={"server_default": "ready"})
+    # SHA-256 of an original upload as received, shared by duplicate uploads
+    content_hash: Optional[str] = Field(default=None, nullable=True, index=True)
 
-    def __init__(self, patient_id: int, original_video: bool, inference_video: bool, video_path: str, create_time: str, update_time: str, is_deleted: bool, action_id: int=None):
+    def __init__(self, patient_id: int, original_video: bool, inference_video: bool, video_path: str, create_time: str, update_time: str, is_deleted: bool, action_id: int=None, status: str = "ready", content_hash: str = None):
         self.patient_id = patient_id
         self.action_id = action_id
         self.original_video = original_video
@@ -24,6 +28,8 @@ class VideoPath(SQLModel, table=True):
         self.create_time = create_time
         self.update_time = update_time
         self.is_deleted = is_deleted
+        self.status = status
+        self.content_hash = content_hash
 
     def to_dict(self):
         return {
@@ -35,5 +41,7 @@ class VideoPath(SQLModel, table=True):
             "video_path": self.video_path,
             "create_time": self.create_time,
             "update_time": self.update_time,
-            "is_deleted": self.is_deleted
+            "is_deleted": self.is_deleted,
+            "status": self.status,
+            "content_hash": self.content_hash
         }